@@ -0,0 +1,124 @@
+import numpy as np
+
+
+def _squared_distances(vectors, centroids):
+    # ||x||^2 - 2 x.c + ||c||^2, clipped because rounding can go slightly negative
+    d = (np.einsum('ij,ij->i', vectors, vectors)[:, None]
+         - 2.0 * vectors @ centroids.T
+         + np.einsum('ij,ij->i', centroids, centroids)[None, :])
+    return np.maximum(d, 0.0)
+
+
+def kmeans(vectors, k, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmin(_squared_distances(vectors, centroids), axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        # Re-seed empty clusters from random points so every list stays usable
+        empty = np.flatnonzero(~non_empty)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), size=len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index with a k-means coarse quantizer.
+
+    The index only stores row ids; the vectors themselves stay in the caller's
+    matrix and are passed to search(), so the gallery can grow or be memory
+    mapped without the index keeping a second copy.
+
+    Knobs:
+      nlist   number of coarse clusters (more lists -> fewer rows per probe)
+      nprobe  clusters scanned per query (more -> higher recall, more latency)
+      strict  also scan every cluster whose radius could still hold a row within
+              the query tolerance, so match decisions equal an exhaustive scan
+    Candidates from the probed lists are always scored with exact float32
+    distances before the tolerance check.
+    """
+
+    def __init__(self, nlist=64, nprobe=8, strict=False, kmeans_iterations=10, train_size=20000, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.strict = strict
+        self.kmeans_iterations = kmeans_iterations
+        self.train_size = train_size
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+        self.radii = None
+        self.trained_size = 0
+        self.size = 0
+
+    def fresh(self):
+        """An untrained index with the same knobs."""
+        return IVFIndex(self.nlist, self.nprobe, self.strict, self.kmeans_iterations, self.train_size, self.seed)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def build(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        nlist = max(1, min(self.nlist, len(vectors)))
+        sample = vectors
+        if len(vectors) > self.train_size:
+            rng = np.random.default_rng(self.seed)
+            sample = vectors[rng.choice(len(vectors), size=self.train_size, replace=False)]
+        self.centroids = kmeans(sample, nlist, self.kmeans_iterations, self.seed)
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self.radii = np.zeros(nlist, dtype=np.float32)
+        self.size = 0
+        self.add(vectors, 0)
+        self.trained_size = len(vectors)
+
+    def add(self, vectors, start_id):
+        """Assigns new rows (ids start_id, start_id + 1, ...) to their nearest list."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        d = _squared_distances(vectors, self.centroids)
+        assignment = np.argmin(d, axis=1)
+        dist = np.sqrt(d[np.arange(len(vectors)), assignment])
+        ids = np.arange(start_id, start_id + len(vectors), dtype=np.int64)
+        for c in np.unique(assignment):
+            in_list = assignment == c
+            self.lists[c] = np.concatenate([self.lists[c], ids[in_list]])
+            self.radii[c] = max(self.radii[c], dist[in_list].max())
+        self.size += len(vectors)
+
+    @property
+    def needs_retrain(self):
+        # Clusters trained on a small gallery get lopsided once it grows a lot
+        return self.size > 4 * max(self.trained_size, 1)
+
+    def candidates(self, query, tolerance=None):
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+        centroid_dist = np.sqrt(_squared_distances(query, self.centroids)[0])
+        nprobe = min(self.nprobe, len(self.lists))
+        probe = np.argpartition(centroid_dist, nprobe - 1)[:nprobe]
+        if self.strict and tolerance is not None:
+            reachable = np.flatnonzero(centroid_dist - self.radii <= tolerance)
+            probe = np.union1d(probe, reachable)
+        return np.concatenate([self.lists[c] for c in probe])
+
+    def search(self, query, vectors, k=1, tolerance=None):
+        """Returns (ids, distances) of the k nearest candidates, nearest first."""
+        ids = self.candidates(query, tolerance)
+        # Rows inserted after the caller took its view of vectors are left for the next search
+        ids = ids[ids < len(vectors)]
+        if len(ids) == 0:
+            return ids, np.empty(0, dtype=np.float32)
+        diff = vectors[ids] - np.asarray(query, dtype=np.float32)
+        dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        k = min(k, len(ids))
+        top = np.argpartition(dist, k - 1)[:k]
+        top = top[np.argsort(dist[top])]
+        return ids[top], dist[top]
@@ -0,0 +1,301 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import time
+
+from attendance_store import KINDS
+from file_utils import atomic_write_json
+
+
+def split_by_day(start_ts, end_ts):
+    """Yields (day, seconds) for the part of [start_ts, end_ts) that falls on each local day."""
+    start = datetime.datetime.fromtimestamp(start_ts)
+    end = datetime.datetime.fromtimestamp(end_ts)
+    while start < end:
+        midnight = datetime.datetime.combine(start.date() + datetime.timedelta(days=1), datetime.time())
+        part_end = min(midnight, end)
+        yield start.date().isoformat(), (part_end - start).total_seconds()
+        start = part_end
+
+
+class AttendanceReport:
+    """
+    Worked-hours aggregates built incrementally from the name,emp_id,timestamp,
+    in/out lines of log.txt.
+
+    refresh() reads the log from the byte offset recorded in the state file,
+    pairs each 'out' with the employee's open 'in' and adds the session to
+    per-day totals ({emp_id: [seconds, sessions, anomalies]}), splitting
+    sessions that cross midnight. Anomalies are an 'out' with no open 'in',
+    an 'in' while a session is already open, and sessions longer than
+    max_session_hours, which are dropped rather than credited; a session
+    still open when the log has moved max_session_hours past its 'in' is
+    dropped then.
+
+    Once the log has moved past a day and no open session started on or
+    before it, the day cannot change any more: its totals are moved to
+    days_dir/<day>.json and dropped from memory. The state file only holds
+    the offset, the open sessions and the days still open, so both loading
+    it and a refresh cost time proportional to the new lines, not to the
+    history. Closed totals are first committed to the state file together
+    with the new offset and then merged into the day files; each day file
+    records which commits it holds, so repeating the merge after a crash
+    never counts them twice. Without a valid state file, or if the log
+    shrank (it was rotated or rewritten), the report is rebuilt from
+    scratch.
+    """
+
+    def __init__(self, log_path='log.txt', state_path=os.path.join('attendance', 'report_state.json'),
+                 max_session_hours=16, days_dir=None):
+        self.log_path = log_path
+        self.state_path = state_path
+        self.days_dir = days_dir or os.path.join(os.path.dirname(state_path), 'report_days')
+        self.max_session_seconds = max_session_hours * 3600
+        self._reset()
+        state = None
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+        if state is not None and state.get('log_path') == os.path.abspath(log_path) and 'closing' in state:
+            self.offset = state['offset']
+            self.names = state['names']
+            self.open_sessions = state['open_sessions']
+            self.expired = state['expired']
+            self.daily = state['daily']
+            self.latest_ts = state['latest_ts']
+            self.closing = state['closing']
+            self.closing_batch = state['closing_batch']
+            # Finish a merge a crash interrupted
+            self._merge_closing()
+        else:
+            # Day files without the state that produced them would be counted again
+            self._clear_days()
+
+    def _reset(self):
+        self.offset = 0
+        self.names = {}
+        self.open_sessions = {}
+        # Sessions dropped for exceeding max_session_hours before their next event arrived
+        self.expired = {}
+        self.daily = {}
+        self.latest_ts = 0.0
+        # Closed days committed to the state file but not yet merged into days_dir
+        self.closing = {}
+        self.closing_batch = None
+
+    def _clear_days(self):
+        if os.path.isdir(self.days_dir):
+            for file in os.listdir(self.days_dir):
+                if file.endswith('.json'):
+                    os.remove(os.path.join(self.days_dir, file))
+
+    def _add(self, day, emp_id, seconds=0.0, sessions=0, anomalies=0):
+        totals = self.daily.setdefault(day, {}).setdefault(emp_id, [0.0, 0, 0])
+        totals[0] += seconds
+        totals[1] += sessions
+        totals[2] += anomalies
+
+    def _apply(self, name, emp_id, ts, kind):
+        self.names[emp_id] = name
+        self.latest_ts = max(self.latest_ts, ts)
+        day = datetime.date.fromtimestamp(ts).isoformat()
+        opened = self.open_sessions.get(emp_id)
+        if self.expired.pop(emp_id, None) is not None and kind == 'out':
+            # The over-long session this 'out' closes was already counted as an anomaly
+            return
+        if kind == 'in':
+            if opened is not None:
+                if ts - opened <= self.max_session_seconds:
+                    # Logged in twice: keep the earlier 'in'
+                    self._add(day, emp_id, anomalies=1)
+                    return
+                # The previous session was never closed
+                self._add(datetime.date.fromtimestamp(opened).isoformat(), emp_id, anomalies=1)
+            self.open_sessions[emp_id] = ts
+            return
+
+        if opened is None or ts < opened:
+            self._add(day, emp_id, anomalies=1)
+            return
+        del self.open_sessions[emp_id]
+        if ts - opened > self.max_session_seconds:
+            self._add(datetime.date.fromtimestamp(opened).isoformat(), emp_id, anomalies=1)
+            return
+        self._add(datetime.date.fromtimestamp(opened).isoformat(), emp_id, sessions=1)
+        for part_day, seconds in split_by_day(opened, ts):
+            self._add(part_day, emp_id, seconds=seconds)
+
+    def refresh(self):
+        """Consumes the lines appended since the last refresh; returns how many were read."""
+        if not os.path.exists(self.log_path):
+            return 0
+        if os.path.getsize(self.log_path) < self.offset:
+            self._reset()
+            self._clear_days()
+
+        with open(self.log_path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        # A line still being written is left for the next refresh
+        end = data.rfind(b'\n') + 1
+        lines = data[:end].decode('utf-8', errors='replace').splitlines()
+        for line in lines:
+            parts = line.strip().split(',')
+            if len(parts) != 4 or parts[3] not in KINDS:
+                continue
+            name, emp_id, stamp, kind = parts
+            try:
+                ts = datetime.datetime.fromisoformat(stamp).timestamp()
+            except ValueError:
+                continue
+            self._apply(name, emp_id, ts, kind)
+
+        self.offset += end
+        if lines:
+            self._expire_sessions()
+            self._close_days()
+            self.save()
+            self._merge_closing()
+        return len(lines)
+
+    def _expire_sessions(self):
+        # Counted now, as the next 'in' or 'out' would, so that they stop holding their day open
+        for emp_id, opened in list(self.open_sessions.items()):
+            if self.latest_ts - opened > self.max_session_seconds:
+                self._add(datetime.date.fromtimestamp(opened).isoformat(), emp_id, anomalies=1)
+                del self.open_sessions[emp_id]
+                self.expired[emp_id] = opened
+
+    def _close_days(self):
+        oldest_open = min(self.open_sessions.values(), default=None)
+        first_open_day = None if oldest_open is None else datetime.date.fromtimestamp(oldest_open).isoformat()
+        latest_day = datetime.date.fromtimestamp(self.latest_ts).isoformat()
+        closed = [day for day in self.daily
+                  if day < latest_day and (first_open_day is None or day < first_open_day)]
+        for day in closed:
+            self.closing[day] = self.daily.pop(day)
+        if closed:
+            # The offset the batch was committed with identifies it in the day files
+            self.closing_batch = self.offset
+
+    def _merge_closing(self):
+        if not self.closing:
+            return
+        os.makedirs(self.days_dir, exist_ok=True)
+        for day, by_emp in self.closing.items():
+            path = os.path.join(self.days_dir, f'{day}.json')
+            record = {'batches': [], 'totals': {}}
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    record = json.load(f)
+            if self.closing_batch in record['batches']:
+                continue
+            # A late line for a closed day merges into the existing totals
+            for emp_id, totals in by_emp.items():
+                row = record['totals'].setdefault(emp_id, [0.0, 0, 0])
+                for i, value in enumerate(totals):
+                    row[i] += value
+            record['batches'].append(self.closing_batch)
+            atomic_write_json(path, record)
+        self.closing = {}
+        self.closing_batch = None
+        self.save()
+
+    def _closed_days(self, start=None, end=None):
+        daily = {}
+        if not os.path.isdir(self.days_dir):
+            return daily
+        for file in os.listdir(self.days_dir):
+            if not file.endswith('.json'):
+                continue
+            day = file[:-len('.json')]
+            date = datetime.date.fromisoformat(day)
+            if (start is not None and date < start) or (end is not None and date > end):
+                continue
+            with open(os.path.join(self.days_dir, file), 'r') as f:
+                daily[day] = json.load(f)['totals']
+        return daily
+
+    def save(self):
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        atomic_write_json(self.state_path, {
+            'log_path': os.path.abspath(self.log_path),
+            'offset': self.offset,
+            'names': self.names,
+            'open_sessions': self.open_sessions,
+            'expired': self.expired,
+            'daily': self.daily,
+            'latest_ts': self.latest_ts,
+            'closing': self.closing,
+            'closing_batch': self.closing_batch,
+        })
+
+    def rows(self, start=None, end=None, period='day', include_open=False, now=None):
+        """
+        (period, emp_id, name, hours, sessions, anomalies, open_now) rows for days in
+        [start, end]. period is 'day' or 'week' (ISO week, e.g. 2024-W07).
+        include_open counts open sessions up to now without storing that time.
+        """
+        daily = self._closed_days(start, end)
+        for day, by_emp in self.daily.items():
+            for emp_id, totals in by_emp.items():
+                row = daily.setdefault(day, {}).setdefault(emp_id, [0.0, 0, 0])
+                for i, value in enumerate(totals):
+                    row[i] += value
+        if include_open:
+            now = time.time() if now is None else now
+            for emp_id, opened in self.open_sessions.items():
+                if now - opened <= self.max_session_seconds:
+                    for day, seconds in split_by_day(opened, now):
+                        daily.setdefault(day, {}).setdefault(emp_id, [0.0, 0, 0])[0] += seconds
+
+        totals = {}
+        for day, by_emp in daily.items():
+            date = datetime.date.fromisoformat(day)
+            if (start is not None and date < start) or (end is not None and date > end):
+                continue
+            if period == 'week':
+                year, week, _ = date.isocalendar()
+                key = f'{year}-W{week:02d}'
+            else:
+                key = day
+            for emp_id, (seconds, sessions, anomalies) in by_emp.items():
+                row = totals.setdefault((key, emp_id), [0.0, 0, 0])
+                row[0] += seconds
+                row[1] += sessions
+                row[2] += anomalies
+
+        return [(key, emp_id, self.names.get(emp_id, ''), round(seconds / 3600, 2), sessions, anomalies,
+                 int(emp_id in self.open_sessions or emp_id in self.expired))
+                for (key, emp_id), (seconds, sessions, anomalies) in sorted(totals.items())]
+
+    def export_csv(self, path, start=None, end=None, period='day', include_open=False):
+        rows = self.rows(start, end, period, include_open)
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([period, 'emp_id', 'name', 'hours', 'sessions', 'anomalies', 'open_now'])
+            writer.writerows(rows)
+        return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental worked-hours report over log.txt")
+    parser.add_argument('--log', default='log.txt')
+    parser.add_argument('--state', default=os.path.join('attendance', 'report_state.json'))
+    parser.add_argument('--period', choices=['day', 'week'], default='day')
+    parser.add_argument('--start', type=datetime.date.fromisoformat)
+    parser.add_argument('--end', type=datetime.date.fromisoformat)
+    parser.add_argument('--include-open', action='store_true', help="Count open sessions up to now")
+    parser.add_argument('--output', default='attendance_report.csv')
+    args = parser.parse_args()
+
+    report = AttendanceReport(args.log, args.state)
+    start = time.perf_counter()
+    new_lines = report.refresh()
+    print(f"Read {new_lines} new lines in {(time.perf_counter() - start) * 1000:.1f} ms")
+    count = report.export_csv(args.output, args.start, args.end, args.period, args.include_open)
+    print(f"Wrote {count} rows to {args.output}")
@@ -0,0 +1,353 @@
+import argparse
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from file_utils import atomic_write_json
+
+EVENT_DTYPE = np.dtype([('ts', '<f8'), ('emp', '<u4'), ('kind', 'u1')])
+KIND_OUT, KIND_IN = 0, 1
+KINDS = {'in': KIND_IN, 'out': KIND_OUT}
+KIND_NAMES = {KIND_IN: 'in', KIND_OUT: 'out'}
+
+# Writer thread control markers
+_FLUSH = object()
+_CLOSE = object()
+
+
+def _day_of(ts):
+    return datetime.date.fromtimestamp(ts).isoformat()
+
+
+def _read_records(path):
+    if not os.path.exists(path):
+        return np.empty(0, dtype=EVENT_DTYPE)
+    # Ignore a partially written trailing record
+    count = os.path.getsize(path) // EVENT_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=EVENT_DTYPE)
+    return np.memmap(path, dtype=EVENT_DTYPE, mode='r', shape=(count,))
+
+
+class AttendanceStore:
+    """
+    Append-only attendance event store.
+
+    Layout of the store directory:
+      employees.json     [[emp_id, name], ...]; the position is the employee slot
+      YYYY-MM-DD.events  that day's fixed-size (ts, slot, kind) records in arrival order
+      YYYY-MM-DD.sorted  the same records sorted by (slot, ts), written once the day is over
+      state.npz          last in/out kind and timestamp per slot, for currently_in()
+
+    record() only enqueues; a background writer thread appends events in
+    batches once batch_size events are pending or flush_interval seconds have
+    passed, optionally fsyncing each batch. With log_path set, every recorded
+    event is also appended to the legacy CSV log.
+    """
+
+    def __init__(self, root='attendance', log_path=None, batch_size=256, flush_interval=1.0, fsync=True):
+        self.root = root
+        self.log_path = log_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        os.makedirs(root, exist_ok=True)
+
+        self._employees_path = os.path.join(root, 'employees.json')
+        self._state_path = os.path.join(root, 'state.npz')
+        self._lock = threading.Lock()
+        self._sorted_cache = {}
+
+        self.employees = []
+        if os.path.exists(self._employees_path):
+            with open(self._employees_path, 'r') as f:
+                self.employees = json.load(f)
+        self._slots = {emp_id: slot for slot, (emp_id, _) in enumerate(self.employees)}
+        self._load_state()
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    # -- writing --
+
+    def record(self, name, emp_id, kind, ts=None):
+        self._queue.put((time.time() if ts is None else ts, name, str(emp_id), kind, True))
+
+    def flush(self):
+        """Blocks until every event recorded so far is on disk."""
+        self._queue.put(_FLUSH)
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(_CLOSE)
+        self._queue.join()
+        self._writer.join()
+
+    def _write_loop(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _FLUSH or item is _CLOSE:
+                self._write_pending(pending, 1)
+                pending, deadline = [], None
+                if item is _CLOSE:
+                    return
+                continue
+
+            if item is not None:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.time() + self.flush_interval
+
+            if pending and (len(pending) >= self.batch_size or time.time() >= deadline):
+                self._write_pending(pending)
+                pending, deadline = [], None
+
+    def _write_pending(self, pending, markers=0):
+        try:
+            self._write_batch(pending)
+        except Exception as e:
+            print(f"attendance store: failed to write {len(pending)} events: {e}")
+        finally:
+            # Never leave flush() waiting on events we could not write
+            for _ in range(len(pending) + markers):
+                self._queue.task_done()
+
+    def _slot_for(self, emp_id, name):
+        slot = self._slots.get(emp_id)
+        if slot is None:
+            slot = len(self.employees)
+            self.employees.append([emp_id, name])
+            self._slots[emp_id] = slot
+        return slot
+
+    def _write_batch(self, events):
+        if not events:
+            return
+        with self._lock:
+            known = len(self.employees)
+            records = np.empty(len(events), dtype=EVENT_DTYPE)
+            for i, (ts, name, emp_id, kind, _) in enumerate(events):
+                records[i] = (ts, self._slot_for(emp_id, name), KINDS[kind])
+            if len(self.employees) != known:
+                atomic_write_json(self._employees_path, self.employees, self.fsync)
+
+            # Time zone offsets are multiples of 15 minutes, so one lookup per quarter hour is enough
+            quarters = (records['ts'] // 900).astype(np.int64)
+            unique_quarters, quarter_index = np.unique(quarters, return_inverse=True)
+            quarter_days = np.array([_day_of(q * 900) for q in unique_quarters.tolist()])
+            days = quarter_days[quarter_index.reshape(-1)]
+            unique_days = np.unique(quarter_days)
+            for day in unique_days:
+                self._append_day(day, records[days == day])
+            self._update_state(records)
+            self._save_state()
+            self._seal_past_days(unique_days[-1])
+
+        if self.log_path:
+            with open(self.log_path, 'a') as f:
+                for ts, name, emp_id, kind, mirror in events:
+                    if mirror:
+                        f.write(f'{name},{emp_id},{datetime.datetime.fromtimestamp(ts)},{kind}\n')
+
+    def _append_day(self, day, records):
+        path = os.path.join(self.root, f'{day}.events')
+        with open(path, 'ab') as f:
+            f.write(records.tobytes())
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        # A late event for an already sealed day invalidates its sorted copy
+        sorted_path = os.path.join(self.root, f'{day}.sorted')
+        if os.path.exists(sorted_path):
+            self._sorted_cache.pop(day, None)
+            os.remove(sorted_path)
+
+    def _seal_past_days(self, today):
+        for file in os.listdir(self.root):
+            if not file.endswith('.events'):
+                continue
+            day = file[:-len('.events')]
+            if day < today and not os.path.exists(os.path.join(self.root, f'{day}.sorted')):
+                self.seal(day)
+
+    def seal(self, day):
+        """Writes the (slot, ts)-sorted copy of a finished day used by events_for()."""
+        records = np.array(_read_records(os.path.join(self.root, f'{day}.events')))
+        records = records[np.lexsort((records['ts'], records['emp']))]
+        path = os.path.join(self.root, f'{day}.sorted')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(records.tobytes())
+        os.replace(path + '.tmp', path)
+
+    # -- presence state --
+
+    def _load_state(self):
+        if os.path.exists(self._state_path):
+            state = np.load(self._state_path)
+            self._last_kind = state['last_kind']
+            self._last_ts = state['last_ts']
+        else:
+            self._last_kind = np.full(len(self.employees), -1, dtype=np.int8)
+            self._last_ts = np.zeros(len(self.employees), dtype=np.float64)
+            for file in sorted(os.listdir(self.root)):
+                if file.endswith('.events'):
+                    self._update_state(_read_records(os.path.join(self.root, file)))
+
+    def _update_state(self, records):
+        grow = len(self.employees) - len(self._last_kind)
+        if grow > 0:
+            self._last_kind = np.concatenate([self._last_kind, np.full(grow, -1, dtype=np.int8)])
+            self._last_ts = np.concatenate([self._last_ts, np.zeros(grow)])
+        if len(records) == 0:
+            return
+        # Keep the newest event per slot, ignoring anything older than what we have
+        order = np.lexsort((records['ts'], records['emp']))
+        records = records[order]
+        last = np.r_[records['emp'][1:] != records['emp'][:-1], True]
+        newest = records[last]
+        newer = newest['ts'] >= self._last_ts[newest['emp']]
+        self._last_kind[newest['emp'][newer]] = newest['kind'][newer]
+        self._last_ts[newest['emp'][newer]] = newest['ts'][newer]
+
+    def _save_state(self):
+        tmp_path = self._state_path + '.tmp.npz'
+        np.savez(tmp_path, last_kind=self._last_kind, last_ts=self._last_ts)
+        os.replace(tmp_path, self._state_path)
+
+    # -- queries --
+
+    def _day_records(self, day):
+        sorted_path = os.path.join(self.root, f'{day}.sorted')
+        if os.path.exists(sorted_path):
+            if day not in self._sorted_cache:
+                self._sorted_cache[day] = _read_records(sorted_path)
+            return self._sorted_cache[day], True
+        return _read_records(os.path.join(self.root, f'{day}.events')), False
+
+    def events_for(self, emp_id, start, end):
+        """
+        All events of emp_id with start <= time < end (datetimes), oldest first,
+        as a list of (datetime, 'in'/'out').
+        """
+        slot = self._slots.get(str(emp_id))
+        if slot is None:
+            return []
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        events = []
+        day = start.date()
+        with self._lock:
+            while day <= end.date():
+                records, is_sorted = self._day_records(day.isoformat())
+                day += datetime.timedelta(days=1)
+                if len(records) == 0:
+                    continue
+                if is_sorted:
+                    emp = records['emp']
+                    lo, hi = np.searchsorted(emp, slot, 'left'), np.searchsorted(emp, slot, 'right')
+                    mine = records[lo:hi]
+                    ts = mine['ts']
+                    mine = mine[np.searchsorted(ts, start_ts, 'left'):np.searchsorted(ts, end_ts, 'left')]
+                else:
+                    mine = records[records['emp'] == slot]
+                    mine = mine[(mine['ts'] >= start_ts) & (mine['ts'] < end_ts)]
+                    mine = mine[np.argsort(mine['ts'], kind='stable')]
+                events.extend((datetime.datetime.fromtimestamp(ts), KIND_NAMES[kind])
+                              for ts, kind in zip(mine['ts'].tolist(), mine['kind'].tolist()))
+        return events
+
+    def refresh(self):
+        """Re-reads the employee list and presence state written by another process."""
+        with self._lock:
+            if os.path.exists(self._employees_path):
+                with open(self._employees_path, 'r') as f:
+                    self.employees = json.load(f)
+            self._slots = {emp_id: slot for slot, (emp_id, _) in enumerate(self.employees)}
+            self._load_state()
+
+    def currently_in(self):
+        """Employees whose latest event is 'in', as a list of (emp_id, name)."""
+        with self._lock:
+            slots = np.flatnonzero(self._last_kind == KIND_IN)
+            return [tuple(self.employees[slot]) for slot in slots]
+
+    # -- import --
+
+    def import_log(self, log_path):
+        """
+        Imports a legacy name,emp_id,timestamp,in/out CSV log. Events already
+        stored (same emp_id, timestamp and kind) are skipped, so re-running is
+        safe and the log can be imported after new events were recorded.
+        Imported events are not mirrored back to log_path. Returns the number
+        of imported events.
+        """
+        by_day = {}
+        with open(log_path, 'r') as f:
+            for line in f:
+                parts = line.strip().split(',')
+                if len(parts) != 4 or parts[3] not in KINDS:
+                    continue
+                name, emp_id, stamp, kind = parts
+                try:
+                    when = datetime.datetime.fromisoformat(stamp)
+                except ValueError:
+                    continue
+                by_day.setdefault(when.date().isoformat(), []).append((when, name, emp_id, kind))
+
+        self.flush()
+        count = 0
+        for day, events in sorted(by_day.items()):
+            # Keys as log.txt writes them, so stored and logged events compare equal
+            with self._lock:
+                records = np.array(self._day_records(day)[0])
+                seen = {(self.employees[slot][0], datetime.datetime.fromtimestamp(ts), KIND_NAMES[kind])
+                        for ts, slot, kind in zip(records['ts'].tolist(), records['emp'].tolist(),
+                                                  records['kind'].tolist())}
+            for when, name, emp_id, kind in events:
+                key = (emp_id, when, kind)
+                if key in seen:
+                    continue
+                seen.add(key)
+                self._queue.put((when.timestamp(), name, emp_id, kind, False))
+                count += 1
+        self.flush()
+        return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Attendance event store")
+    parser.add_argument('--root', default='attendance')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help="Import a legacy log.txt")
+    import_parser.add_argument('log_path', nargs='?', default='log.txt')
+    events_parser = subparsers.add_parser('events', help="List events of one employee")
+    events_parser.add_argument('emp_id')
+    events_parser.add_argument('start', type=datetime.date.fromisoformat)
+    events_parser.add_argument('end', type=datetime.date.fromisoformat)
+    subparsers.add_parser('in', help="List employees currently logged in")
+    args = parser.parse_args()
+
+    store = AttendanceStore(args.root, fsync=False)
+    if args.command == 'import':
+        print(f"Imported {store.import_log(args.log_path)} events")
+    elif args.command == 'events':
+        start = datetime.datetime.combine(args.start, datetime.time())
+        end = datetime.datetime.combine(args.end, datetime.time()) + datetime.timedelta(days=1)
+        for when, kind in store.events_for(args.emp_id, start, end):
+            print(f'{when},{kind}')
+    else:
+        for emp_id, name in store.currently_in():
+            print(f'{name},{emp_id}')
+    store.close()
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+import util
+from face_detectors import DETECTORS, get_detector
+from gallery import FaceGallery
+
+
+def load_frames(path, limit=None):
+    frames = []
+    if os.path.isdir(path):
+        for file in sorted(os.listdir(path)):
+            if file.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
+                frame = cv2.imread(os.path.join(path, file))
+                if frame is not None:
+                    frames.append(frame)
+            if limit and len(frames) >= limit:
+                break
+    else:
+        cap = cv2.VideoCapture(path)
+        while not limit or len(frames) < limit:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    return frames
+
+
+def bench_scales(frames, scales, repeat=1, gallery=None, tolerance=0.53):
+    """
+    Times util.detect_and_encode at each detection scale and compares the
+    outcome with full-resolution detection on the same frames. With a gallery
+    the matched identities are compared as well.
+    """
+    def identity(outcome):
+        status, _, encoding = outcome
+        if status is not None or gallery is None:
+            return status
+        return gallery.match(encoding, tolerance)
+
+    reference = [util.detect_and_encode(frame, 1.0) for frame in frames]
+    results = []
+    for scale in scales:
+        latencies = []
+        outcomes = []
+        for _ in range(repeat):
+            outcomes = []
+            for frame in frames:
+                start = time.perf_counter()
+                outcomes.append(util.detect_and_encode(frame, scale))
+                latencies.append(time.perf_counter() - start)
+
+        same_status = 0
+        same_identity = 0
+        max_distance = 0.0
+        for ref, outcome in zip(reference, outcomes):
+            if outcome[0] == ref[0]:
+                same_status += 1
+                if ref[0] is None:
+                    max_distance = max(max_distance, float(np.linalg.norm(ref[2] - outcome[2])))
+            if identity(outcome) == identity(ref):
+                same_identity += 1
+
+        latencies_ms = np.array(latencies) * 1000
+        results.append({
+            'scale': scale,
+            'mean_ms': float(latencies_ms.mean()),
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p99_ms': float(np.percentile(latencies_ms, 99)),
+            'same_status': same_status,
+            'same_identity': same_identity if gallery is not None else None,
+            'max_encoding_distance': max_distance,
+        })
+
+    base = results[0]['mean_ms'] if results and results[0]['scale'] == 1.0 else None
+    for result in results:
+        result['speedup'] = base / result['mean_ms'] if base else None
+    return results
+
+
+def iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(bottom - top, 0) * max(right - left, 0)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter) if inter else 0.0
+
+
+def bench_detectors(frames, detectors, repeat=1, ground_truth=None, reference='hog', detection_scale=1.0,
+                    min_iou=0.3):
+    """
+    Times each detector backend on the frames and scores it against ground
+    truth boxes (one list of (top, right, bottom, left) per frame) or, without
+    them, against the reference backend's detections. Recall is the share of
+    true faces found with IoU >= min_iou; extra detections overlap none.
+    """
+    if ground_truth is None:
+        ground_truth = [util.detect_faces(frame, detection_scale, reference) for frame in frames]
+    total_faces = sum(len(boxes) for boxes in ground_truth)
+
+    results = []
+    for name in detectors:
+        try:
+            get_detector(name)
+        except (FileNotFoundError, RuntimeError) as e:
+            results.append({'detector': name, 'error': str(e)})
+            continue
+        latencies = []
+        detections = []
+        for _ in range(repeat):
+            detections = []
+            for frame in frames:
+                start = time.perf_counter()
+                detections.append(util.detect_faces(frame, detection_scale, name))
+                latencies.append(time.perf_counter() - start)
+
+        found = 0
+        extra = 0
+        for truth, boxes in zip(ground_truth, detections):
+            found += sum(1 for t in truth if any(iou(t, box) >= min_iou for box in boxes))
+            extra += sum(1 for box in boxes if all(iou(t, box) < min_iou for t in truth))
+
+        latencies_ms = np.array(latencies) * 1000
+        results.append({
+            'detector': name,
+            'mean_ms': float(latencies_ms.mean()),
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p99_ms': float(np.percentile(latencies_ms, 99)),
+            'faces': total_faces,
+            'recall': found / total_faces if total_faces else None,
+            'extra_detections': extra,
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure downscaled face detection latency and agreement")
+    parser.add_argument('source', help="Directory of images or a video file")
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.75, 0.5, 0.35, 0.25])
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--db', help="face_db directory; compares matched identities across scales")
+    parser.add_argument('--json', dest='json_path', help="Write results to this JSON file")
+    parser.add_argument('--detectors', nargs='+', choices=sorted(DETECTORS),
+                        help="Compare detector backends instead of scales")
+    parser.add_argument('--ground-truth', help="JSON list with the [top, right, bottom, left] face boxes of each "
+                                               "frame, in load order (default: the --reference detector's boxes)")
+    parser.add_argument('--reference', choices=sorted(DETECTORS), default='hog')
+    parser.add_argument('--detection-scale', type=float, default=1.0)
+    args = parser.parse_args()
+
+    frames = load_frames(args.source, args.limit)
+    if not frames:
+        raise SystemExit(f"No frames found in {args.source}")
+
+    if args.detectors:
+        ground_truth = None
+        if args.ground_truth:
+            with open(args.ground_truth, 'r') as f:
+                ground_truth = [[tuple(box) for box in boxes] for boxes in json.load(f)][:len(frames)]
+        results = bench_detectors(frames, args.detectors, args.repeat, ground_truth, args.reference,
+                                  args.detection_scale)
+        truth = 'ground truth' if ground_truth else f"{args.reference} detections"
+        for r in results:
+            if 'error' in r:
+                print(f"{r['detector']}: skipped, {r['error']}")
+                continue
+            recall = f"{r['recall']:.1%}" if r['recall'] is not None else "-"
+            print(f"{r['detector']}: {r['mean_ms']:.1f} ms mean, {r['p99_ms']:.1f} ms p99, "
+                  f"recall {recall} of {r['faces']} faces ({truth}), {r['extra_detections']} extra detections")
+        if args.json_path:
+            with open(args.json_path, 'w') as f:
+                json.dump({'frames': len(frames), 'results': results}, f, indent=4)
+        raise SystemExit(0)
+
+    gallery = FaceGallery.from_db(args.db) if args.db else None
+    results = bench_scales(frames, args.scales, args.repeat, gallery)
+    for r in results:
+        speedup = f"{r['speedup']:.2f}x" if r['speedup'] else "-"
+        line = (f"scale {r['scale']:.2f}: {r['mean_ms']:.1f} ms mean, {r['p99_ms']:.1f} ms p99, {speedup}, "
+                f"{r['same_status']}/{len(frames)} same detection status, "
+                f"max encoding drift {r['max_encoding_distance']:.3f}")
+        if gallery is not None:
+            line += f", {r['same_identity']}/{len(frames)} same identity"
+        print(line)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'frames': len(frames), 'results': results}, f, indent=4)
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import pickle
+import platform
+import shutil
+import tempfile
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+import util
+from bench_detection import load_frames
+from bench_utils import make_synthetic_db, time_stage
+from embedding_store import EmbeddingStore, store_dir_for
+from gallery import FaceGallery
+from quantization_check import run_check
+from user_directory import UserDirectory
+
+
+def synthetic_frame(width=640, height=480, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(frame, (7, 7), 0)
+
+
+def load_pickle_gallery(db_dir):
+    """The per-user pickle scan recognize() used to do on every presence tick."""
+    all_encodings = []
+    all_names = []
+    for user in os.listdir(db_dir):
+        multi_path = os.path.join(db_dir, user, 'multi_encodings.pkl')
+        if not os.path.exists(multi_path):
+            continue
+        with open(multi_path, 'rb') as f:
+            encodings = pickle.load(f)
+        all_encodings.extend(encodings)
+        all_names.extend([user] * len(encodings))
+    return all_encodings, all_names
+
+
+def bench_frame_stages(frame, repeat):
+    """cvtColor, face_locations and face_encodings on one frame."""
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    face_locations = face_recognition.face_locations(rgb_frame)
+    # Synthetic frames contain no face; encode a centered box so the stage is still timed
+    height, width = frame.shape[:2]
+    encode_locations = face_locations[:1] or [(height // 4, width * 3 // 4, height * 3 // 4, width // 4)]
+    return {
+        'faces_found': len(face_locations),
+        'cvt_color': time_stage(lambda: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), repeat),
+        'face_locations': time_stage(lambda: face_recognition.face_locations(rgb_frame), repeat),
+        'face_encodings': time_stage(lambda: face_recognition.face_encodings(rgb_frame, encode_locations), repeat),
+    }
+
+
+def bench_gallery(db_dir, users, per_user, repeat, legacy_limit):
+    store = EmbeddingStore(store_dir_for(db_dir))
+    gallery = FaceGallery.from_store(store)
+    avg_gallery = FaceGallery.from_store(store, use_avg=True)
+    known_encodings, known_names = util.load_known_faces(db_dir, store)
+    probe = np.asarray(store.multi[len(store.multi) // 2], dtype=np.float64)
+    users_file = os.path.join(db_dir, 'users.json')
+    directory = UserDirectory(users_file)
+
+    def read_users_json():
+        with open(users_file, 'r') as f:
+            return json.load(f).get('user0', "N/A")
+
+    result = {
+        'users': users,
+        'encodings_per_user': per_user,
+        'startup': {
+            'open_store': time_stage(lambda: EmbeddingStore(store_dir_for(db_dir)), repeat),
+            'load_known_faces': time_stage(lambda: util.load_known_faces(db_dir), max(1, repeat // 5)),
+            'gallery_from_store': time_stage(lambda: FaceGallery.from_store(EmbeddingStore(store_dir_for(db_dir))),
+                                             repeat),
+        },
+        'avg_encoding_path': {
+            'compare_faces': time_stage(
+                lambda: face_recognition.compare_faces(known_encodings, probe, tolerance=0.43), repeat),
+            'gallery_match': time_stage(lambda: avg_gallery.match(probe, 0.43), repeat),
+        },
+        'multi_encoding_path': {
+            'gallery_match': time_stage(lambda: gallery.match(probe, 0.53), repeat),
+        },
+        'users_lookup': {
+            'users_json_read': time_stage(read_users_json, repeat),
+            'user_directory': time_stage(lambda: directory.emp_id_for('user0'), repeat),
+        },
+    }
+
+    # The old per-tick pickle scan is far too slow to repeat on big galleries
+    if users <= legacy_limit:
+        legacy_runs = max(1, repeat // 10)
+        all_encodings, _ = load_pickle_gallery(db_dir)
+        result['multi_encoding_path']['pickle_scan'] = time_stage(lambda: load_pickle_gallery(db_dir), legacy_runs)
+        result['multi_encoding_path']['compare_faces'] = time_stage(
+            lambda: face_recognition.compare_faces(all_encodings, probe, tolerance=0.53), legacy_runs)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of the recognition hot path")
+    parser.add_argument('--frames', help="Directory of images or a video file (default: a synthetic frame)")
+    parser.add_argument('--users', type=int, nargs='+', default=[100, 1000, 10000],
+                        help="Synthetic gallery sizes, e.g. 100 1000 10000 100000")
+    parser.add_argument('--per-user', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--legacy-limit', type=int, default=10000,
+                        help="Largest gallery for which the legacy pickle scan is timed")
+    parser.add_argument('--output', default='bench_recognition.json')
+    parser.add_argument('--check-quantization', action='store_true',
+                        help="Only verify that float16/int8 galleries make the same match decisions "
+                             "(also runnable without dlib as quantization_check.py); exits non-zero on any difference")
+    args = parser.parse_args()
+
+    if args.check_quantization:
+        check, passed = run_check(args.users[0], args.per_user, {'nlist': 64, 'nprobe': 8})
+        print(json.dumps(check, indent=4))
+        if not passed:
+            raise SystemExit("Quantized gallery changed match decisions")
+        raise SystemExit(0)
+
+    frames = load_frames(args.frames, limit=5) if args.frames else [synthetic_frame()]
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'frame_shape': list(frames[0].shape),
+        'frame_stages': [bench_frame_stages(frame, args.repeat) for frame in frames],
+        'galleries': [],
+    }
+
+    for users in args.users:
+        db_dir = tempfile.mkdtemp(prefix='bench_face_db_')
+        try:
+            make_synthetic_db(db_dir, users, args.per_user, pickles=users <= args.legacy_limit)
+            report['galleries'].append(bench_gallery(db_dir, users, args.per_user, args.repeat, args.legacy_limit))
+        finally:
+            shutil.rmtree(db_dir)
+        print(f"{users} users done")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Wrote {args.output}")
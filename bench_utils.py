@@ -0,0 +1,49 @@
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, store_dir_for
+
+
+def time_stage(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return {
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+
+def make_synthetic_db(db_dir, users, per_user, seed=0, pickles=True):
+    """
+    Writes a synthetic face_db with `users` users of `per_user` encodings each,
+    both as the embedding store and (optionally) as legacy per-user pickles.
+    """
+    rng = np.random.default_rng(seed)
+    store = EmbeddingStore(store_dir_for(db_dir))
+    users_data = {}
+    new_users = []
+    for i in range(users):
+        name = f'user{i}'
+        center = rng.normal(0, 0.1, 128)
+        encodings = center + rng.normal(0, 0.02, (per_user, 128))
+        new_users.append((name, encodings.mean(axis=0), encodings))
+        users_data[name] = f'emp{i}'
+        if pickles:
+            user_dir = os.path.join(db_dir, name)
+            os.makedirs(user_dir, exist_ok=True)
+            with open(os.path.join(user_dir, 'multi_encodings.pkl'), 'wb') as f:
+                pickle.dump(list(encodings), f)
+            with open(os.path.join(user_dir, 'avg_encoding.pkl'), 'wb') as f:
+                pickle.dump(encodings.mean(axis=0), f)
+    store.add_users(new_users)
+    with open(os.path.join(db_dir, 'users.json'), 'w') as f:
+        json.dump(users_data, f)
@@ -0,0 +1,172 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import util
+from compaction import compact_encodings
+from embedding_store import open_store
+from user_directory import get_user_directory
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def encode_image(path, max_side=800):
+    """Returns (encoding, error) for a photo that should show exactly one face."""
+    try:
+        frame = cv2.imread(path)
+        if frame is None:
+            return None, 'unreadable image'
+        # Large photos are detected on a downscaled copy and encoded from the full-resolution crop
+        detection_scale = min(1.0, max_side / max(frame.shape[:2]))
+        status, _, encoding = util.detect_and_encode(frame, detection_scale)
+    except Exception as e:
+        # One bad image must not abort the whole run
+        return None, str(e)
+    if status is not None:
+        return None, status
+    return encoding, None
+
+
+def read_roster(csv_path):
+    """Rows of the name/emp_id CSV; an optional 'folder' column overrides the photo folder."""
+    with open(csv_path, newline='') as f:
+        return [{key.strip().lower(): (value or '').strip() for key, value in row.items()}
+                for row in csv.DictReader(f)]
+
+
+def photos_for(photos_dir, row):
+    """Image paths for one person: a folder named after folder/name/emp_id, or a single <name>.<ext> file."""
+    for folder in (row.get('folder'), row['name'], row['emp_id']):
+        if not folder:
+            continue
+        path = os.path.join(photos_dir, folder)
+        if os.path.isdir(path):
+            return sorted(os.path.join(root, file) for root, _, files in os.walk(path)
+                          for file in files if file.lower().endswith(IMAGE_EXTENSIONS))
+        for ext in IMAGE_EXTENSIONS:
+            if os.path.isfile(path + ext):
+                return [path + ext]
+    return []
+
+
+def bulk_enroll(photos_dir, csv_path, db_dir='face_db', workers=None, commit_every=25, prototypes=None,
+                failures_path=None):
+    """
+    Encodes every roster member's photos on a process pool and appends them to
+    the embedding store in batches of commit_every users. users.json is
+    written once at the end. Users already in the store or in users.json are
+    skipped, so an interrupted run can simply be started again.
+    """
+    store = open_store(db_dir)
+    users = get_user_directory(os.path.join(db_dir, 'users.json'))
+    known = users.as_dict()
+    taken_emp_ids = set(known.values())
+
+    roster = read_roster(csv_path)
+    pending = []
+    queued_names = set()
+    new_users = {}
+    failures = []
+    skipped = 0
+    for row in roster:
+        name, emp_id = row.get('name'), row.get('emp_id')
+        if not name or not emp_id:
+            failures.append((csv_path, f"row without name or emp_id: {row}"))
+            continue
+        if name in store:
+            # Encoded by an earlier, interrupted run; only users.json may be missing it
+            if name not in known and name not in new_users:
+                new_users[name] = emp_id
+                taken_emp_ids.add(emp_id)
+            skipped += 1
+            continue
+        if name in queued_names:
+            failures.append((csv_path, f"duplicate name {name} (emp_id {emp_id}); only the first row is used"))
+            continue
+        if name in known or emp_id in taken_emp_ids:
+            skipped += 1
+            continue
+        queued_names.add(name)
+        taken_emp_ids.add(emp_id)
+        paths = photos_for(photos_dir, row)
+        if not paths:
+            failures.append((os.path.join(photos_dir, name), 'no photos found'))
+            continue
+        pending.append((name, emp_id, paths))
+
+    images = [path for _, _, paths in pending for path in paths]
+    start = time.perf_counter()
+    batch = []
+    processed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(encode_image, images, chunksize=4)
+        for name, emp_id, paths in pending:
+            encodings = []
+            for path in paths:
+                encoding, error = next(results)
+                processed += 1
+                if error is None:
+                    encodings.append(encoding)
+                else:
+                    failures.append((path, error))
+            if not encodings:
+                failures.append((name, 'no usable face in any photo'))
+                continue
+            avg_encoding = np.mean(encodings, axis=0)
+            if prototypes:
+                encodings = compact_encodings(encodings, prototypes)
+            batch.append((name, avg_encoding, encodings))
+            new_users[name] = emp_id
+            if len(batch) >= commit_every:
+                store.add_users(batch)
+                batch = []
+                elapsed = time.perf_counter() - start
+                print(f"{processed}/{len(images)} images, {len(store)} users in store, "
+                      f"{processed / elapsed:.1f} images/s")
+    if batch:
+        store.add_users(batch)
+    elapsed = time.perf_counter() - start
+
+    if new_users:
+        users.update(new_users)
+    if failures_path and failures:
+        with open(failures_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['path', 'error'])
+            writer.writerows(failures)
+
+    return {
+        'enrolled': len(new_users),
+        'skipped': skipped,
+        'images': len(images),
+        'seconds': elapsed,
+        'images_per_second': len(images) / elapsed if elapsed > 0 else 0.0,
+        'failures': failures,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enroll employees from a directory of photos and a name/emp_id CSV")
+    parser.add_argument('photos_dir', help="One folder (or one image file) per person, named after name or emp_id")
+    parser.add_argument('csv_path', help="CSV with name and emp_id columns, optionally a folder column")
+    parser.add_argument('--db', default='face_db')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--commit-every', type=int, default=25, help="Users written to the store per batch")
+    parser.add_argument('--prototypes', type=int, default=None,
+                        help="Keep at most this many representative encodings per user")
+    parser.add_argument('--failures', default='bulk_enroll_failures.csv', help="Where to write per-image failures")
+    args = parser.parse_args()
+
+    report = bulk_enroll(args.photos_dir, args.csv_path, args.db, args.workers, args.commit_every, args.prototypes,
+                         args.failures)
+    print(f"Enrolled {report['enrolled']} users, skipped {report['skipped']} already enrolled")
+    print(f"{report['images']} images in {report['seconds']:.1f}s ({report['images_per_second']:.1f} images/s)")
+    if report['failures']:
+        print(f"{len(report['failures'])} failures, see {args.failures}")
+        for path, error in report['failures'][:10]:
+            print(f"  {path}: {error}")
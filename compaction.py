@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+from embedding_store import EmbeddingStore, store_dir_for, store_lock
+from gallery import FaceGallery
+
+
+def sharpness(image):
+    """Variance of the Laplacian; low values mean a blurry image."""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return float(cv2.Laplacian(image, cv2.CV_64F).var())
+
+
+def drop_outliers(encodings, max_deviations=3.0, min_keep=3):
+    """
+    Indexes of encodings whose distance to the user's median encoding is
+    within max_deviations median absolute deviations of the typical distance.
+    """
+    if len(encodings) <= min_keep:
+        return np.arange(len(encodings))
+    distances = np.linalg.norm(encodings - np.median(encodings, axis=0), axis=1)
+    center = np.median(distances)
+    spread = np.median(np.abs(distances - center)) or 1e-6
+    keep = np.flatnonzero(distances <= center + max_deviations * spread)
+    if len(keep) < min_keep:
+        keep = np.argsort(distances)[:min_keep]
+    return keep
+
+
+def farthest_point_prototypes(encodings, count=8, min_distance=0.15):
+    """
+    Greedy farthest-point selection starting from the medoid. Stops after
+    count prototypes or once every encoding is within min_distance of one.
+    Returns indexes into encodings.
+    """
+    pairwise = np.linalg.norm(encodings[:, None, :] - encodings[None, :, :], axis=2)
+    chosen = [int(np.argmin(pairwise.sum(axis=1)))]
+    nearest = pairwise[chosen[0]].copy()
+    while len(chosen) < min(count, len(encodings)):
+        candidate = int(np.argmax(nearest))
+        if nearest[candidate] < min_distance:
+            break
+        chosen.append(candidate)
+        nearest = np.minimum(nearest, pairwise[candidate])
+    return np.array(chosen)
+
+
+def compact_encodings(encodings, prototypes=8, min_distance=0.15, max_deviations=3.0):
+    """Returns a user's representative encodings after dropping outliers."""
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+    if len(encodings) <= 1:
+        return encodings
+    inliers = encodings[drop_outliers(encodings, max_deviations)]
+    return inliers[farthest_point_prototypes(inliers, prototypes, min_distance)]
+
+
+def evaluate(store, holdout_every=5, prototypes=8, min_distance=0.15, tolerance=0.53, repeat=20):
+    """
+    Holds out every holdout_every-th encoding of each user, then compares
+    matching the held-out probes against the remaining encodings as stored and
+    against their prototypes: match rate and per-query latency.
+    """
+    full = FaceGallery()
+    compact = FaceGallery()
+    probes, probe_names = [], []
+    for name in store.names:
+        encodings = np.asarray(store.user_encodings(name))
+        held_out = np.zeros(len(encodings), dtype=bool)
+        held_out[holdout_every - 1::holdout_every] = True
+        if held_out.all() or not held_out.any():
+            continue
+        full.add_user(name, encodings[~held_out])
+        compact.add_user(name, compact_encodings(encodings[~held_out], prototypes, min_distance))
+        probes.extend(encodings[held_out])
+        probe_names.extend([name] * int(held_out.sum()))
+
+    report = {'users': len(store), 'probes': len(probes)}
+    if not probes:
+        return report
+    for label, gallery in (('full', full), ('compact', compact)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for probe in probes[:100]:
+                gallery.match(probe, tolerance)
+        query_ms = (time.perf_counter() - start) * 1000 / (repeat * min(len(probes), 100))
+        matched = gallery.match_batch(probes, tolerance)
+        report[label] = {
+            'rows': len(gallery),
+            'query_ms': query_ms,
+            'match_rate': float(np.mean([m == name for m, name in zip(matched, probe_names)])),
+        }
+    report['speedup'] = report['full']['query_ms'] / report['compact']['query_ms']
+    return report
+
+
+def compact_store(db_dir, prototypes=8, min_distance=0.15, keep_backup=True):
+    """
+    Rewrites the embedding store of db_dir with each user's prototypes. The
+    new store is built next to the old one and swapped in; the old one is kept
+    as <store>.bak-<timestamp> unless keep_backup is False.
+    """
+    store_dir = store_dir_for(db_dir)
+    # Held until the swap, so no writer appends to the store being replaced
+    with store_lock(store_dir):
+        store = EmbeddingStore(store_dir)
+        compact_dir = store_dir + '.compact'
+        shutil.rmtree(compact_dir, ignore_errors=True)
+        compacted = EmbeddingStore(compact_dir)
+        compacted.add_users([
+            (name, store.avg[i], compact_encodings(store.user_encodings(name), prototypes, min_distance))
+            for i, name in enumerate(store.names)
+        ])
+        if not compacted.exists():
+            os.makedirs(compact_dir, exist_ok=True)
+            compacted._write_index()
+
+        backup_dir = f"{store_dir}.bak-{time.strftime('%Y%m%d%H%M%S')}"
+        os.replace(store_dir, backup_dir)
+        os.replace(compact_dir, store_dir)
+        # Only this function ever wrote the temporary store
+        os.remove(compact_dir + '.lock')
+    if not keep_backup:
+        shutil.rmtree(backup_dir)
+    return int(store.counts.sum()), int(compacted.counts.sum())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact each user's stored encodings into a few prototypes")
+    parser.add_argument('db_dir', nargs='?', default='face_db')
+    parser.add_argument('--prototypes', type=int, default=8, help="Maximum prototypes kept per user")
+    parser.add_argument('--min-distance', type=float, default=0.15,
+                        help="Stop adding prototypes once every encoding is this close to one")
+    parser.add_argument('--report-only', action='store_true', help="Evaluate on held-out encodings, don't rewrite")
+    parser.add_argument('--no-backup', action='store_true')
+    args = parser.parse_args()
+
+    store = EmbeddingStore(store_dir_for(args.db_dir))
+    print(json.dumps(evaluate(store, prototypes=args.prototypes, min_distance=args.min_distance), indent=4))
+    if not args.report_only:
+        before, after = compact_store(args.db_dir, args.prototypes, args.min_distance, not args.no_backup)
+        print(f"Compacted {len(store)} users from {before} to {after} encodings")
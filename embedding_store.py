@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import pickle
+from contextlib import contextmanager
+
+import numpy as np
+
+from file_utils import atomic_write_json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+ENCODING_DIM = 128
+STORE_DIR_NAME = 'embeddings'
+
+
+@contextmanager
+def store_lock(store_dir):
+    """
+    Exclusive lock for writers of the store in store_dir, across processes.
+    The lock file sits next to the directory so it survives compaction
+    swapping the directory out.
+    """
+    lock_path = os.path.normpath(store_dir) + '.lock'
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _map_matrix(path, rows):
+    if rows == 0:
+        return np.empty((0, ENCODING_DIM), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode='r', shape=(rows, ENCODING_DIM))
+
+
+class EmbeddingStore:
+    """
+    Single on-disk store for all users' encodings.
+
+    Layout of the store directory:
+      multi.f32   raw float32 rows, every user's multi encodings back to back
+      avg.f32     raw float32 rows, one average encoding per user
+      index.json  {"dim": 128, "users": [[name, offset, count], ...]}
+
+    Both matrices are opened with np.memmap in read-only mode, so startup does
+    not parse anything per user and several processes share the same pages.
+    Rows past what index.json records are ignored, which keeps a crash in the
+    middle of an append from corrupting the store. Writers hold store_lock()
+    and re-read index.json under it, so several processes can append.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.multi_path = os.path.join(store_dir, 'multi.f32')
+        self.avg_path = os.path.join(store_dir, 'avg.f32')
+        self.index_path = os.path.join(store_dir, 'index.json')
+        self.names = []
+        self._positions = {}
+        self.offsets = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.multi = _map_matrix(self.multi_path, 0)
+        self.avg = _map_matrix(self.avg_path, 0)
+        if self.exists():
+            self.load()
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    def load(self):
+        with open(self.index_path, 'r') as f:
+            index = json.load(f)
+        users = index.get('users', [])
+        self.names = [user[0] for user in users]
+        self._positions = {name: i for i, name in enumerate(self.names)}
+        self.offsets = np.array([user[1] for user in users], dtype=np.int64)
+        self.counts = np.array([user[2] for user in users], dtype=np.int64)
+        self.multi = _map_matrix(self.multi_path, int(self.counts.sum()))
+        self.avg = _map_matrix(self.avg_path, len(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def labels(self):
+        """Name for every row of the multi matrix."""
+        return np.repeat(np.array(self.names, dtype=object), self.counts)
+
+    def user_encodings(self, name):
+        i = self._positions[name]
+        return self.multi[self.offsets[i]:self.offsets[i] + self.counts[i]]
+
+    def _append_rows(self, path, rows, expected_rows):
+        expected_size = expected_rows * ENCODING_DIM * 4
+        with open(path, 'ab') as f:
+            size = os.path.getsize(path)
+            if size < expected_size:
+                raise RuntimeError(f"{path} is shorter than its index ({size} < {expected_size} bytes)")
+            # Drop rows left behind by an append that never made it into the index
+            if size > expected_size:
+                f.truncate(expected_size)
+            f.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_index(self):
+        users = [[name, int(offset), int(count)]
+                 for name, offset, count in zip(self.names, self.offsets, self.counts)]
+        atomic_write_json(self.index_path, {'dim': ENCODING_DIM, 'users': users})
+
+    def add_user(self, name, avg_encoding, encodings):
+        """Appends one user in place; existing rows are never rewritten."""
+        self.add_users([(name, avg_encoding, encodings)])
+
+    def add_users(self, users):
+        """Appends several (name, avg_encoding, encodings) users with one index write."""
+        names = [name for name, _, _ in users]
+        multi = [np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM) for _, _, encodings in users]
+        avg = [np.asarray(avg_encoding, dtype=np.float32).reshape(1, ENCODING_DIM) for _, avg_encoding, _ in users]
+        if not users:
+            return
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        with store_lock(self.store_dir):
+            # Another process may have appended since we loaded; offsets come from the index on disk
+            if self.exists():
+                self.load()
+            existing = set(self.names)
+            for name in names:
+                if name in existing or names.count(name) > 1:
+                    raise ValueError(f"User '{name}' is already in the embedding store")
+
+            total_rows = int(self.counts.sum())
+            self._append_rows(self.multi_path, np.concatenate(multi), total_rows)
+            self._append_rows(self.avg_path, np.concatenate(avg), len(self.names))
+
+            counts = np.array([len(encodings) for encodings in multi], dtype=np.int64)
+            self.names = self.names + names
+            self.offsets = np.concatenate([self.offsets, total_rows + np.cumsum(counts) - counts])
+            self.counts = np.concatenate([self.counts, counts])
+            self._write_index()
+            self.load()
+
+
+def store_dir_for(db_dir):
+    return os.path.join(db_dir, STORE_DIR_NAME)
+
+
+def migrate_pickle_db(db_dir, store=None):
+    """
+    One-shot import of the face_db/<user>/avg_encoding.pkl and
+    multi_encodings.pkl layout. Users already in the store are skipped.
+    Returns the list of imported user names.
+    """
+    if store is None:
+        store = EmbeddingStore(store_dir_for(db_dir))
+    imported = []
+    for user in sorted(os.listdir(db_dir)):
+        user_path = os.path.join(db_dir, user)
+        if user == STORE_DIR_NAME or not os.path.isdir(user_path) or user in store:
+            continue
+
+        multi_path = os.path.join(user_path, 'multi_encodings.pkl')
+        if not os.path.exists(multi_path):
+            continue
+        try:
+            with open(multi_path, 'rb') as f:
+                encodings = pickle.load(f)
+        except Exception:
+            continue
+        if len(encodings) == 0:
+            continue
+
+        avg_path = os.path.join(user_path, 'avg_encoding.pkl')
+        if os.path.exists(avg_path):
+            with open(avg_path, 'rb') as f:
+                avg_encoding = pickle.load(f)
+        else:
+            avg_encoding = np.mean(encodings, axis=0)
+
+        store.add_user(user, avg_encoding, encodings)
+        imported.append(user)
+
+    if not store.exists():
+        os.makedirs(store.store_dir, exist_ok=True)
+        store._write_index()
+    return imported
+
+
+def open_store(db_dir):
+    """Opens the store for db_dir, migrating the pickle layout the first time."""
+    store = EmbeddingStore(store_dir_for(db_dir))
+    if not store.exists() and os.path.isdir(db_dir):
+        migrate_pickle_db(db_dir, store)
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate per-user pickle encodings into the embedding store")
+    parser.add_argument('db_dir', nargs='?', default='face_db')
+    args = parser.parse_args()
+
+    imported = migrate_pickle_db(args.db_dir)
+    print(f"Imported {len(imported)} users into {store_dir_for(args.db_dir)}")
@@ -0,0 +1,96 @@
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from compaction import compact_encodings, sharpness
+from util import lazy_import
+
+face_recognition = lazy_import('face_recognition')
+
+
+def encode_face(rgb_frame, face_location):
+    encodings = face_recognition.face_encodings(rgb_frame, [face_location])
+    return encodings[0] if encodings else None
+
+
+def encode_face_sample(rgb_frame, face_location):
+    """Encoding of the face plus the sharpness of its crop."""
+    top, right, bottom, left = face_location
+    crop = rgb_frame[max(top, 0):bottom, max(left, 0):right]
+    return encode_face(rgb_frame, face_location), sharpness(crop) if crop.size else 0.0
+
+
+class EnrollmentPipeline:
+    """
+    Encodes registration frames while they are still being captured.
+
+    The capture loop hands each RGB frame together with the face location it
+    already found to submit(); encoding runs on a worker pool and never goes
+    through disk. finish() waits for the remaining work and returns the average
+    and per-frame encodings. If archive_dir is set, the original BGR frames are
+    written there as JPEGs by a background thread.
+
+    Samples whose face crop is less than blur_ratio times as sharp as the
+    median sample are dropped. With prototypes set, finish() returns at most
+    that many representative encodings (see compaction.compact_encodings)
+    instead of every sample; the average is still taken over all kept samples.
+    """
+
+    def __init__(self, workers=None, use_processes=False, archive_dir=None, blur_ratio=0.5, prototypes=None):
+        self.blur_ratio = blur_ratio
+        self.prototypes = prototypes
+        workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor = executor_cls(max_workers=workers)
+        self._futures = []
+
+        self.archive_dir = archive_dir
+        self._archive_queue = None
+        self._archive_thread = None
+        if archive_dir is not None:
+            os.makedirs(archive_dir, exist_ok=True)
+            self._archive_queue = queue.Queue()
+            self._archive_thread = threading.Thread(target=self._archive_worker, daemon=True)
+            self._archive_thread.start()
+
+    def _archive_worker(self):
+        while True:
+            item = self._archive_queue.get()
+            if item is None:
+                return
+            index, frame = item
+            cv2.imwrite(os.path.join(self.archive_dir, f'{index}.jpg'), frame)
+
+    def submit(self, rgb_frame, face_location, bgr_frame=None):
+        index = len(self._futures)
+        self._futures.append(self._executor.submit(encode_face_sample, rgb_frame, face_location))
+        if self._archive_queue is not None and bgr_frame is not None:
+            self._archive_queue.put((index, bgr_frame))
+
+    def finish(self):
+        """Returns (avg_encoding, encodings); avg_encoding is None if nothing encoded."""
+        encodings = []
+        sharpness_scores = []
+        for future in self._futures:
+            encoding, score = future.result()
+            if encoding is not None:
+                encodings.append(encoding)
+                sharpness_scores.append(score)
+        self._executor.shutdown()
+
+        if encodings and self.blur_ratio:
+            min_sharpness = self.blur_ratio * np.median(sharpness_scores)
+            encodings = [e for e, score in zip(encodings, sharpness_scores) if score >= min_sharpness]
+
+        if self._archive_thread is not None:
+            self._archive_queue.put(None)
+            self._archive_thread.join()
+
+        avg_encoding = np.mean(encodings, axis=0) if encodings else None
+        if encodings and self.prototypes:
+            encodings = list(compact_encodings(encodings, self.prototypes))
+        return avg_encoding, encodings
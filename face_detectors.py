@@ -0,0 +1,110 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+# Local files for the DNN backend (OpenCV's res10 SSD face detector)
+DNN_MODEL_DIR = os.environ.get('FACE_DETECTOR_MODEL_DIR', 'models')
+DNN_CONFIG = 'deploy.prototxt'
+DNN_WEIGHTS = 'res10_300x300_ssd_iter_140000.caffemodel'
+
+
+def _clip_box(x, y, w, h, width, height):
+    """(x, y, w, h) to a (top, right, bottom, left) location inside the frame."""
+    return (max(int(y), 0), min(int(x + w), width), min(int(y + h), height), max(int(x), 0))
+
+
+class HogDetector:
+    """dlib's HOG detector through face_recognition; the original detector."""
+
+    name = 'hog'
+
+    def __init__(self, upsample=1):
+        self.upsample = upsample
+
+    def detect(self, frame):
+        # Imported here so picking another backend never loads dlib's models
+        import face_recognition
+        return face_recognition.face_locations(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), self.upsample)
+
+
+class HaarDetector:
+    """OpenCV's frontal face Haar cascade, shipped with cv2; fastest, least accurate."""
+
+    name = 'haar'
+
+    def __init__(self, cascade='haarcascade_frontalface_default.xml', scale_factor=1.1, min_neighbors=5,
+                 min_size=(40, 40)):
+        self.path = os.path.join(cv2.data.haarcascades, cascade)
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        # Cascades are not safe to share between threads
+        self._local = threading.local()
+
+    def _cascade(self):
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = self._local.cascade = cv2.CascadeClassifier(self.path)
+            if cascade.empty():
+                raise RuntimeError(f"Could not load Haar cascade {self.path}")
+        return cascade
+
+    def detect(self, frame):
+        gray = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        boxes = self._cascade().detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                                 minNeighbors=self.min_neighbors, minSize=self.min_size)
+        height, width = frame.shape[:2]
+        return [_clip_box(x, y, w, h, width, height) for x, y, w, h in boxes]
+
+
+class DnnDetector:
+    """OpenCV DNN SSD face detector loaded from local model files; most robust to pose and lighting."""
+
+    name = 'dnn'
+
+    def __init__(self, model_dir=DNN_MODEL_DIR, confidence=0.6, input_size=300):
+        self.config_path = os.path.join(model_dir, DNN_CONFIG)
+        self.weights_path = os.path.join(model_dir, DNN_WEIGHTS)
+        for path in (self.config_path, self.weights_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"DNN face detector model file not found: {path} "
+                                        f"(set FACE_DETECTOR_MODEL_DIR)")
+        self.confidence = confidence
+        self.input_size = input_size
+        # One network per thread; forward() is not thread-safe
+        self._local = threading.local()
+
+    def _net(self):
+        net = getattr(self._local, 'net', None)
+        if net is None:
+            net = self._local.net = cv2.dnn.readNetFromCaffe(self.config_path, self.weights_path)
+        return net
+
+    def detect(self, frame):
+        height, width = frame.shape[:2]
+        blob = cv2.dnn.blobFromImage(frame, 1.0, (self.input_size, self.input_size), (104.0, 177.0, 123.0))
+        net = self._net()
+        net.setInput(blob)
+        detections = net.forward().reshape(-1, 7)
+        detections = detections[detections[:, 2] >= self.confidence]
+        boxes = detections[:, 3:7] * np.array([width, height, width, height])
+        return [_clip_box(x0, y0, x1 - x0, y1 - y0, width, height) for x0, y0, x1, y1 in boxes]
+
+
+DETECTORS = {cls.name: cls for cls in (HogDetector, HaarDetector, DnnDetector)}
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_detector(detector='hog'):
+    """Returns the shared detector for a backend name; detector objects are passed through."""
+    if not isinstance(detector, str):
+        return detector
+    with _instances_lock:
+        if detector not in _instances:
+            if detector not in DETECTORS:
+                raise ValueError(f"Unknown face detector '{detector}', expected one of {sorted(DETECTORS)}")
+            _instances[detector] = DETECTORS[detector]()
+        return _instances[detector]
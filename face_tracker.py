@@ -0,0 +1,139 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import util
+
+
+class FaceTracker:
+    """
+    Keeps a recognized identity attached to its face box between frames.
+
+    observe() is cheap and meant to be called on every preview frame: it moves
+    the box with sparse Lucas-Kanade optical flow on a downscaled grayscale
+    image. recognize() only runs face detection and encoding when the track is
+    lost, the box jumped, or reverify_interval seconds passed since the last
+    embedding; otherwise it returns the tracked identity.
+    """
+
+    def __init__(self, reverify_interval=30.0, max_jump=0.5, min_points=8, scale=0.5, max_flow_error=10.0,
+                 detection_scale=1.0, detector='hog'):
+        self.detection_scale = detection_scale
+        self.detector = detector
+        self.reverify_interval = reverify_interval
+        self.max_jump = max_jump
+        self.max_flow_error = max_flow_error
+        self.min_points = min_points
+        self.scale = scale
+        self.stats = {
+            'detections_run': 0,
+            'detections_skipped': 0,
+            'encodings_run': 0,
+            'encodings_skipped': 0,
+            'tracks_lost': 0,
+        }
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._prev_gray = None
+            self._points = None
+            self._box = None
+            self._identity = None
+            self._last_verified = 0.0
+            self._jumped = False
+
+    @property
+    def tracking(self):
+        return self._identity is not None
+
+    def _gray(self, frame):
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def _start_track(self, frame, face_location, identity):
+        gray = self._gray(frame)
+        top, right, bottom, left = [int(v * self.scale) for v in face_location]
+        mask = np.zeros_like(gray)
+        mask[max(top, 0):bottom, max(left, 0):right] = 255
+        points = cv2.goodFeaturesToTrack(gray, maxCorners=40, qualityLevel=0.01, minDistance=3, mask=mask)
+        if points is None or len(points) < self.min_points:
+            self._identity = None
+            return
+        self._prev_gray = gray
+        self._points = points
+        self._box = np.array([left, top, right, bottom], dtype=np.float32)
+        self._identity = identity
+        self._last_verified = time.time()
+        self._jumped = False
+
+    def _lose_track(self):
+        if self._identity is not None:
+            self.stats['tracks_lost'] += 1
+        self._identity = None
+        self._points = None
+
+    def observe(self, frame):
+        """Moves the tracked box to the given frame."""
+        with self._lock:
+            if self._identity is None:
+                return
+            gray = self._gray(frame)
+            points, status, error = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, self._points, None)
+            if points is None:
+                self._lose_track()
+                return
+            # Forward-backward check: keep points that flow back to where they started
+            back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, points, None)
+            fb_error = np.linalg.norm((back - self._points).reshape(-1, 2), axis=1)
+            good = ((status.reshape(-1) == 1) & (back_status.reshape(-1) == 1)
+                    & (fb_error < 1.0) & (error.reshape(-1) < self.max_flow_error))
+            if good.sum() < self.min_points:
+                self._lose_track()
+                return
+
+            shift = np.median(points[good] - self._points[good], axis=0).reshape(-1)
+            width = self._box[2] - self._box[0]
+            if np.hypot(shift[0], shift[1]) > self.max_jump * width:
+                self._jumped = True
+
+            self._box += np.array([shift[0], shift[1], shift[0], shift[1]], dtype=np.float32)
+            self._points = points[good].reshape(-1, 1, 2)
+            self._prev_gray = gray
+
+    def recognize(self, frame, identify_fn):
+        """
+        Returns the same (status, emp_id) pair as util.recognize().
+        identify_fn(encoding) maps a fresh encoding to that pair.
+        """
+        with self._lock:
+            self.observe(frame)
+            fresh = time.time() - self._last_verified < self.reverify_interval
+            if self._identity is not None and fresh and not self._jumped:
+                self.stats['detections_skipped'] += 1
+                self.stats['encodings_skipped'] += 1
+                return self._identity
+
+        status, face_location, encoding = util.detect_and_encode(frame, self.detection_scale, self.detector)
+        self.stats['detections_run'] += 1
+        if status is not None:
+            with self._lock:
+                self._lose_track()
+            return status, None
+
+        self.stats['encodings_run'] += 1
+        result = identify_fn(encoding)
+        with self._lock:
+            if result[0] in ('unknown_person', 'no_persons_found', 'multiple_faces_detected'):
+                self._lose_track()
+            else:
+                self._start_track(frame, face_location, result)
+        return result
+
+    def report(self):
+        s = self.stats
+        return (f"face tracker: {s['detections_skipped']} detections and {s['encodings_skipped']} encodings "
+                f"avoided, {s['detections_run']} detections run, {s['tracks_lost']} tracks lost")
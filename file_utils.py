@@ -0,0 +1,13 @@
+import json
+import os
+
+
+def atomic_write_json(path, data, fsync=True):
+    """Writes data as JSON to path through a temporary file, so readers never see a partial file."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
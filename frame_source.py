@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class WebcamSource:
+    def __init__(self, device=0):
+        self.cap = cv2.VideoCapture(device)
+
+    def read(self):
+        return self.cap.read()
+
+    def release(self):
+        self.cap.release()
+
+
+class VideoFileSource:
+    """Plays a recorded video at its own frame rate, optionally looping."""
+
+    def __init__(self, path, loop=True, realtime=True):
+        self.path = path
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+        self.frame_interval = 1.0 / fps if realtime else 0.0
+        self._next_time = time.time()
+
+    def read(self):
+        delay = self._next_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_time = max(self._next_time, time.time() - self.frame_interval) + self.frame_interval
+
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageDirectorySource:
+    """Replays the images of a directory in name order at a fixed frame rate."""
+
+    def __init__(self, path, fps=10.0, loop=True):
+        self.paths = [os.path.join(path, file) for file in sorted(os.listdir(path))
+                      if file.lower().endswith(IMAGE_EXTENSIONS)]
+        self.frame_interval = 1.0 / fps if fps else 0.0
+        self.loop = loop
+        self._index = 0
+        self._next_time = time.time()
+
+    def read(self):
+        if self._index >= len(self.paths):
+            if not self.loop or not self.paths:
+                return False, None
+            self._index = 0
+
+        delay = self._next_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_time = max(self._next_time, time.time() - self.frame_interval) + self.frame_interval
+
+        frame = cv2.imread(self.paths[self._index])
+        self._index += 1
+        return frame is not None, frame
+
+    def release(self):
+        pass
+
+
+def open_source(spec=0):
+    """
+    Builds a frame source from a device index (int or digit string), a video
+    file path or a directory of images.
+    """
+    if isinstance(spec, int) or str(spec).isdigit():
+        return WebcamSource(int(spec))
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec)
+    return VideoFileSource(spec)
+
+
+class FrameGrabber:
+    """
+    Owns a frame source on a single capture thread and publishes every frame
+    into a small ring buffer.
+
+    Frames are stored by reference (each read() returns a fresh array), so
+    consumers get the newest frame without copying and must treat it as
+    read-only. latest() never blocks; wait_next() blocks until a frame newer
+    than the one the caller already has arrives.
+    """
+
+    def __init__(self, source, buffer_size=4):
+        self.source = source
+        self.buffer_size = buffer_size
+        self._frames = [None] * buffer_size
+        self._ids = [0] * buffer_size
+        self._consumed = [True] * buffer_size
+        self._frame_id = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.stats = {'frames_captured': 0, 'frames_dropped': 0, 'read_failures': 0}
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self.source.release()
+
+    def _run(self):
+        while self._running:
+            ret, frame = self.source.read()
+            if not ret:
+                self.stats['read_failures'] += 1
+                time.sleep(0.01)
+                continue
+
+            with self._cond:
+                self._frame_id += 1
+                slot = self._frame_id % self.buffer_size
+                if not self._consumed[slot]:
+                    self.stats['frames_dropped'] += 1
+                self._frames[slot] = frame
+                self._ids[slot] = self._frame_id
+                self._consumed[slot] = False
+                self.stats['frames_captured'] += 1
+                self._cond.notify_all()
+
+    def _get(self, slot):
+        self._consumed[slot] = True
+        return self._ids[slot], self._frames[slot]
+
+    def latest(self):
+        """Returns (frame_id, frame); frame_id is 0 and frame None before the first frame."""
+        with self._cond:
+            return self._get(self._frame_id % self.buffer_size)
+
+    def wait_next(self, last_id=0, timeout=1.0):
+        """Blocks until a frame newer than last_id is available. Returns (0, None) on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._frame_id > last_id or not self._running, timeout):
+                return 0, None
+            return self._get(self._frame_id % self.buffer_size)
+
+    def recent(self, count=None):
+        """Returns up to count of the newest buffered frames, oldest first."""
+        with self._cond:
+            count = min(count or self.buffer_size, self.buffer_size, self._frame_id)
+            first = self._frame_id - count + 1
+            return [self._frames[i % self.buffer_size] for i in range(first, self._frame_id + 1)]
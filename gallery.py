@@ -0,0 +1,299 @@
+import numpy as np
+
+from ann_index import IVFIndex
+from embedding_store import open_store
+
+ENCODING_DIM = 128
+QUANTIZE_BLOCK_ROWS = 65536
+
+
+def quantize_rows(rows, precision):
+    """
+    Returns (codes, scales) for float16 or int8 storage of the rows. int8 codes
+    carry one float32 scale per row (max abs value / 127); float16 has none.
+    """
+    rows = np.asarray(rows, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    if precision == 'float16':
+        return rows.astype(np.float16), None
+    if precision == 'int8':
+        scales = np.abs(rows).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(rows / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unknown precision '{precision}', expected 'float16' or 'int8'")
+
+
+def dequantize_rows(codes, scales):
+    rows = codes.astype(np.float32)
+    return rows if scales is None else rows * scales[:, None]
+
+
+class FaceGallery:
+    """
+    In-memory gallery of face encodings.
+    All encodings live in one contiguous float32 (N x 128) matrix with a
+    parallel array of user names, so a query is a single vectorized
+    distance computation plus argmin.
+    """
+
+    def __init__(self, capacity=256):
+        self._encodings = np.empty((capacity, ENCODING_DIM), dtype=np.float32)
+        self._labels = np.empty(capacity, dtype=object)
+        self._size = 0
+        self._rows = {}
+        self.index = None
+        self.index_report = None
+        self.precision = None
+        self.rerank = 8
+        self._codes = None
+        self._scales = None
+        self._code_norms = None
+
+    @classmethod
+    def from_store(cls, store, use_avg=False):
+        """
+        Wraps the store's memory-mapped matrix without copying it. The first
+        add_user() moves the rows into a private, growable buffer.
+        With use_avg the gallery holds one average encoding per user instead.
+        """
+        gallery = cls(capacity=1)
+        matrix = store.avg if use_avg else store.multi
+        if len(matrix) == 0:
+            return gallery
+        gallery._encodings = matrix
+        gallery._labels = np.array(store.names, dtype=object) if use_avg else store.labels()
+        gallery._size = len(matrix)
+        for i, name in enumerate(store.names):
+            if use_avg:
+                gallery._rows[name] = [(i, i + 1)]
+            else:
+                gallery._rows[name] = [(int(store.offsets[i]), int(store.offsets[i] + store.counts[i]))]
+        return gallery
+
+    @classmethod
+    def from_db(cls, db_dir):
+        return cls.from_store(open_store(db_dir))
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def encodings(self):
+        # _size is read first: a grown buffer is always swapped in before _size moves past the old one
+        size = self._size
+        return self._encodings[:size]
+
+    @property
+    def labels(self):
+        size = self._size
+        return self._labels[:size]
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        capacity = len(self._labels)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        encodings = np.empty((capacity, ENCODING_DIM), dtype=np.float32)
+        labels = np.empty(capacity, dtype=object)
+        encodings[:self._size] = self._encodings[:self._size]
+        labels[:self._size] = self._labels[:self._size]
+        self._encodings, self._labels = encodings, labels
+
+    def add_user(self, name, encodings):
+        """Appends a user's encodings without touching the rest of the gallery."""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        if len(encodings) == 0:
+            return
+        self._reserve(len(encodings))
+        start, end = self._size, self._size + len(encodings)
+        self._encodings[start:end] = encodings
+        self._labels[start:end] = name
+        if self.precision is not None:
+            self._append_codes(encodings)
+        # Published last: a concurrent match() only reads rows below _size, which are complete
+        self._size = end
+        self._rows.setdefault(name, []).append((start, end))
+
+        index = self.index
+        if index is not None:
+            if not index.is_trained or index.needs_retrain:
+                # Built aside and swapped in, so a concurrent match() never sees a half-built index
+                rebuilt = index.fresh()
+                rebuilt.build(self.encodings)
+                self.index = rebuilt
+            else:
+                index.add(encodings, start)
+
+    def build_index(self, min_recall=None, recall_tolerance=0.53, recall_probes=200, max_scanned=0.5, **params):
+        """
+        Switches match() to an approximate IVF search (see IVFIndex for the
+        nlist / nprobe / strict knobs). New users are inserted incrementally.
+
+        With min_recall, the index is first checked against an exhaustive scan
+        (see check_recall); nprobe is doubled until the index makes at least
+        that fraction of the same decisions. If it cannot, or it still scans
+        more than max_scanned of the rows, no index is used and None is
+        returned. The last check is kept in index_report.
+        """
+        index = IVFIndex(**params)
+        if self._size:
+            index.build(self.encodings)
+        self.index_report = None
+        if min_recall is not None and self._size:
+            while True:
+                report = self.check_recall(index, recall_tolerance, recall_probes)
+                if report['recall'] >= min_recall or index.nprobe >= len(index.lists):
+                    break
+                index.nprobe = min(index.nprobe * 2, len(index.lists))
+            self.index_report = report
+            if report['recall'] < min_recall or report['scanned'] > max_scanned:
+                self.index = None
+                return None
+        self.index = index
+        return index
+
+    def check_recall(self, index, tolerance=0.53, probes=200, seed=0):
+        """
+        Compares the index with an exhaustive scan on stored rows perturbed to
+        about tolerance away, where a missed candidate would change the
+        decision. Returns the fraction of equal decisions and of rows scanned.
+        """
+        rng = np.random.default_rng(seed)
+        rows = np.asarray(self._encodings[rng.integers(0, self._size, probes)], dtype=np.float32)
+        queries = rows + rng.normal(0, tolerance / np.sqrt(ENCODING_DIM), rows.shape).astype(np.float32)
+        exact = self._match_exhaustive(queries, tolerance)
+        same = 0
+        scanned = 0
+        for query, expected in zip(queries, exact):
+            ids, distances = index.search(query, self.encodings, k=1, tolerance=tolerance)
+            found = self._labels[ids[0]] if len(ids) and distances[0] <= tolerance else None
+            same += found == expected
+            scanned += len(index.candidates(query, tolerance))
+        return {'recall': same / len(queries), 'scanned': scanned / (len(queries) * self._size),
+                'nprobe': index.nprobe}
+
+    def quantize(self, precision='int8', rerank=8):
+        """
+        Keeps a float16 or int8 copy of the gallery for match(): candidates (all
+        rows, or the IVF index's candidates when one is built) are ranked on the
+        compact copy and the best rerank of them are re-scored on the float32
+        rows before the tolerance check.
+        Scans read 2x (float16) or 4x (int8) fewer bytes; when the gallery
+        wraps the store's memmap only the re-scored rows are paged in. NumPy
+        has no fast float16 matmul, so float16 saves memory but int8 is the
+        faster of the two.
+        """
+        self.precision = precision
+        self.rerank = rerank
+        self._codes = None
+        self._scales = None
+        self._code_norms = None
+        # Converted in blocks so a memmapped gallery is never loaded whole
+        for start in range(0, self._size, QUANTIZE_BLOCK_ROWS):
+            self._append_codes(self._encodings[start:min(start + QUANTIZE_BLOCK_ROWS, self._size)])
+        return self
+
+    def _append_codes(self, rows):
+        codes, scales = quantize_rows(rows, self.precision)
+        decoded = dequantize_rows(codes, scales)
+        norms = np.einsum('ij,ij->i', decoded, decoded)
+        if self._codes is None:
+            self._codes, self._scales, self._code_norms = codes, scales, norms
+            return
+        self._codes = np.concatenate([self._codes, codes])
+        self._code_norms = np.concatenate([self._code_norms, norms])
+        if scales is not None:
+            self._scales = np.concatenate([self._scales, scales])
+
+    def _quantized_match(self, encoding, tolerance, ids=None):
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        # Codes are appended before _size grows, so they always cover size rows
+        size, codes, scales, norms = self._size, self._codes, self._scales, self._code_norms
+        if ids is None:
+            approx = np.empty(size, dtype=np.float32)
+            for start in range(0, size, QUANTIZE_BLOCK_ROWS):
+                end = min(start + QUANTIZE_BLOCK_ROWS, size)
+                dots = codes[start:end].astype(np.float32) @ encoding
+                if scales is not None:
+                    dots *= scales[start:end]
+                approx[start:end] = norms[start:end] - 2.0 * dots
+            ids = np.arange(size)
+        else:
+            dots = codes[ids].astype(np.float32) @ encoding
+            if scales is not None:
+                dots *= scales[ids]
+            approx = norms[ids] - 2.0 * dots
+        if len(ids) == 0:
+            return None
+        k = min(self.rerank, len(ids))
+        candidates = ids[np.argpartition(approx, k - 1)[:k]] if k < len(ids) else ids
+        candidates = np.sort(candidates)
+        # Exact float32 distances for the few candidates only
+        diff = np.asarray(self._encodings[candidates], dtype=np.float32) - encoding
+        distances = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        best = int(np.argmin(distances))
+        if distances[best] <= tolerance:
+            return self._labels[candidates[best]]
+        return None
+
+    def user_encodings(self, name):
+        return [self._encodings[start:end] for start, end in self._rows.get(name, [])]
+
+    def verify(self, encoding, name, tolerance=0.53, chunk_size=8):
+        """
+        1:1 check of a probe against only this user's encodings, a few rows
+        at a time, stopping at the first one within tolerance. The cost does
+        not depend on the size of the gallery.
+        """
+        encoding = np.asarray(encoding, dtype=np.float32)
+        squared_tolerance = tolerance * tolerance
+        for rows in self.user_encodings(name):
+            for start in range(0, len(rows), chunk_size):
+                diff = rows[start:start + chunk_size] - encoding
+                if np.einsum('ij,ij->i', diff, diff).min() <= squared_tolerance:
+                    return True
+        return False
+
+    def distances(self, encoding):
+        diff = self.encodings - np.asarray(encoding, dtype=np.float32)
+        return np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+    def match_batch(self, encodings, tolerance=0.53):
+        """Matches several probe encodings in one vectorized call; returns a name or None per probe."""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        if self._size == 0 or len(encodings) == 0:
+            return [None] * len(encodings)
+        if (self.index is not None and self.index.is_trained) or self.precision is not None:
+            return [self.match(encoding, tolerance) for encoding in encodings]
+        return self._match_exhaustive(encodings, tolerance)
+
+    def _match_exhaustive(self, encodings, tolerance):
+        gallery = self.encodings
+        squared = (np.einsum('ij,ij->i', encodings, encodings)[:, None]
+                   - 2.0 * encodings @ gallery.T
+                   + np.einsum('ij,ij->i', gallery, gallery)[None, :])
+        best = np.argmin(squared, axis=1)
+        best_distances = np.sqrt(np.maximum(squared[np.arange(len(encodings)), best], 0.0))
+        return [self._labels[i] if d <= tolerance else None for i, d in zip(best, best_distances)]
+
+    def match(self, encoding, tolerance=0.53):
+        """Returns the name of the closest encoding within tolerance, or None."""
+        if self._size == 0:
+            return None
+        # One read: add_user() may swap in a retrained index meanwhile
+        index = self.index
+        if index is not None and index.is_trained:
+            if self.precision is not None:
+                return self._quantized_match(encoding, tolerance, index.candidates(encoding, tolerance))
+            ids, distances = index.search(encoding, self.encodings, k=1, tolerance=tolerance)
+            if len(ids) and distances[0] <= tolerance:
+                return self._labels[ids[0]]
+            return None
+        if self.precision is not None:
+            return self._quantized_match(encoding, tolerance)
+        distances = self.distances(encoding)
+        best = int(np.argmin(distances))
+        if distances[best] <= tolerance:
+            return self._labels[best]
+        return None
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Set FACE_ATTENDANCE_METRICS=1 to turn instrumentation on
+ENABLED = os.environ.get('FACE_ATTENDANCE_METRICS', '0').lower() not in ('', '0', 'false', 'no')
+DUMP_PATH = os.environ.get('FACE_ATTENDANCE_METRICS_FILE', 'metrics.json')
+DUMP_INTERVAL = float(os.environ.get('FACE_ATTENDANCE_METRICS_INTERVAL', '60'))
+
+# Upper bounds of the latency buckets in ms, roughly 4 per doubling from 0.1 ms to ~100 s
+BUCKET_BOUNDS_MS = 0.1 * 2 ** (np.arange(81) / 4)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; recording is one binary search and an increment."""
+
+    def __init__(self):
+        self.counts = np.zeros(len(BUCKET_BOUNDS_MS) + 1, dtype=np.int64)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        self.counts[np.searchsorted(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile."""
+        if self.count == 0:
+            return 0.0
+        bucket = int(np.searchsorted(np.cumsum(self.counts), self.count * p / 100.0))
+        if bucket >= len(BUCKET_BOUNDS_MS):
+            return self.max_ms
+        return float(min(BUCKET_BOUNDS_MS[bucket], self.max_ms))
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max_ms,
+        }
+
+
+class Metrics:
+    """
+    Per-stage latency histograms and event counters for the recognition hot path.
+
+    When disabled, timed() and incr() return immediately so call sites can stay
+    instrumented in production. Collectors are callables returning a dict of
+    counters kept elsewhere (e.g. FrameGrabber.stats), read at summary time.
+    """
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._dump_thread = None
+        self._stop_dump = threading.Event()
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.record(seconds * 1000)
+
+    @contextmanager
+    def timed(self, stage):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def incr(self, name, count=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def collect(self, prefix, fn):
+        self.collectors[prefix] = fn
+
+    def summary(self):
+        with self._lock:
+            counters = dict(self.counters)
+            stages = {stage: histogram.summary() for stage, histogram in sorted(self.histograms.items())}
+        for prefix, fn in self.collectors.items():
+            for name, value in dict(fn()).items():
+                counters[f'{prefix}_{name}'] = value
+        return {
+            'uptime_s': time.time() - self.started,
+            'counters': counters,
+            'stages': stages,
+        }
+
+    def dump(self, path=DUMP_PATH):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+        os.replace(tmp_path, path)
+
+    def start_periodic_dump(self, path=DUMP_PATH, interval=DUMP_INTERVAL):
+        if not self.enabled or self._dump_thread is not None:
+            return
+
+        def run():
+            while not self._stop_dump.wait(interval):
+                self.dump(path)
+
+        self._dump_thread = threading.Thread(target=run, daemon=True)
+        self._dump_thread.start()
+
+    def stop_periodic_dump(self, path=DUMP_PATH):
+        if self._dump_thread is None:
+            return
+        self._stop_dump.set()
+        self._dump_thread.join()
+        self._dump_thread = None
+        self.dump(path)
+
+
+metrics = Metrics()
+timed = metrics.timed
+incr = metrics.incr
+
+
+def format_summary(summary):
+    lines = [f"uptime: {summary['uptime_s']:.0f}s"]
+    for name, value in sorted(summary['counters'].items()):
+        lines.append(f"{name:<28}{value:>10}")
+    lines.append(f"{'stage':<28}{'count':>8}{'mean':>10}{'p50':>10}{'p99':>10}{'max':>10}  (ms)")
+    for stage, s in summary['stages'].items():
+        lines.append(f"{stage:<28}{s['count']:>8}{s['mean_ms']:>10.1f}{s['p50_ms']:>10.1f}"
+                     f"{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print a summary of a metrics dump")
+    parser.add_argument('path', nargs='?', default=DUMP_PATH)
+    args = parser.parse_args()
+
+    with open(args.path, 'r') as f:
+        print(format_summary(json.load(f)))
@@ -1,21 +1,40 @@
+import time
+
+_process_start = time.perf_counter()
+
+import argparse
 import os
-import datetime
 import json
 import tkinter as tk
 import cv2
 from PIL import Image, ImageTk
-import face_recognition
 import threading
-import time
-import numpy as np
-import pickle
+import traceback
 
-from timing_counters import update_attendance, get_user_timer_data
+from timing_counters import (engine as presence_engine, update_attendance, update_attendance_many, get_user_timer_data,
+                            start_attendance, stop_attendance)
 import util
+from attendance_store import AttendanceStore
+from embedding_store import open_store
+from enrollment import EnrollmentPipeline
+from face_detectors import DETECTORS
+from face_tracker import FaceTracker
+from frame_source import FrameGrabber, open_source
+from gallery import FaceGallery
+from instrumentation import incr, metrics, timed
+from motion_gate import MotionGate
+from preview import PreviewRenderer
+from recognition_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RecognitionScheduler
+from user_directory import get_user_directory
 
 
 class App:
-    def __init__(self):
+    def __init__(self, source=0, multi_person=False, startup_report=None, exit_when_ready=False,
+                 gallery_precision=None, presence_detector='hog', enrollment_detector='hog'):
+        self.startup_timings = {'imports': time.perf_counter() - _process_start}
+        self.startup_report = startup_report
+        self.exit_when_ready = exit_when_ready
+        self.ready = False
         self.main_window = tk.Tk()
 
         # Dynamically center the main window
@@ -41,6 +60,13 @@ class App:
             self.main_window, 'register new user', 'gray', self.register_new_user, fg='black')
         self.register_new_user_button_main_window.place(x=750, y=400)
 
+        # Enabled by _on_ready() once the models and the gallery are loaded
+        for button in (self.login_button_main_window, self.logout_button_main_window,
+                       self.register_new_user_button_main_window):
+            button.config(state='disabled')
+        self.label_status = tk.Label(self.main_window, text="Loading face models...", font=("Helvetica", 12))
+        self.label_status.place(x=750, y=170)
+
         self.webcam_label = util.get_img_label(self.main_window)
         self.webcam_label.place(x=10, y=0, width=700, height=500)
 
@@ -53,100 +79,272 @@ class App:
         self.label_total_missed = tk.Label(self.main_window, text="Total Missed: 0s", font=("Helvetica", 12))
         self.label_total_missed.place(x=750, y=90)
 
-        self.add_webcam(self.webcam_label)
+        self.current_user = None
+        # Face detector backend per call site (see face_detectors): presence checks can use a
+        # fast one, enrollment an accurate one
+        self.presence_detector = presence_detector
+        self.enrollment_detector = enrollment_detector
+        # Presence checks detect on a half-size frame and encode from the full-resolution crop
+        self.face_tracker = FaceTracker(detection_scale=0.5, detector=presence_detector)
+        # Presence is polled often but only re-checked when the scene changed
+        self.motion_gate = MotionGate()
+        self.presence_poll_interval = 1000
+        self.last_presence = False
+        self.last_seen_names = []
+        self.add_webcam(self.webcam_label, source)
+        self.startup_timings['window'] = time.perf_counter() - _process_start
 
         self.db_dir = "face_db"
         os.makedirs(self.db_dir, exist_ok=True)
-        self.known_encodings, self.known_names, self.multi_encodings_dict = util.load_known_faces(self.db_dir)
-
+        # Switch to the IVF index once exhaustive scans get expensive; it is only kept if it makes
+        # the same decisions as an exhaustive scan on the recall check and actually prunes
+        self.ann_min_gallery_size = 20000
+        # Optionally scan a float16/int8 copy of the galleries, re-ranking candidates in float32
+        self.gallery_precision = gallery_precision
 
         self.users_file_path = os.path.join(self.db_dir, 'users.json')
         if not os.path.exists(self.users_file_path) or os.path.getsize(self.users_file_path) == 0:
             with open(self.users_file_path, 'w') as f:
                 json.dump({}, f)
+        self.user_directory = get_user_directory(self.users_file_path)
 
         self.log_path = './log.txt'
-        self.current_user = None
+        # Events are batched by a background writer; log.txt is kept as a mirror
+        new_store = not os.path.exists(os.path.join('attendance', 'employees.json'))
+        self.attendance_store = AttendanceStore('attendance', log_path=self.log_path)
+        if new_store and os.path.exists(self.log_path):
+            # First run with the store: bring the legacy history in before any new event
+            self.attendance_store.import_log(self.log_path)
+
+        # Presence counters survive restarts through periodic snapshots
+        presence_engine.snapshot_path = os.path.join('attendance', 'presence.npz')
+        if os.path.exists(presence_engine.snapshot_path):
+            presence_engine.restore(presence_engine.snapshot_path)
         self.update_timers_job = None
         self.logged_in_emp_ids = set()
 
-    def add_webcam(self, label):
-        self.cap = cv2.VideoCapture(0)
+        # Shared-workspace mode: several people logged in and monitored by one camera
+        self.multi_person = multi_person
+        self.logged_in_users = {}
+
+        # Every recognition runs here: bounded workers, login/logout ahead of presence checks
+        self.recognition_scheduler = RecognitionScheduler(workers=2)
+        self._interactive_request = None
+        self._presence_request = None
+
+        # Opt-in latency histograms and counters (FACE_ATTENDANCE_METRICS=1)
+        metrics.collect('frames', lambda: self.frame_grabber.stats)
+        metrics.collect('scheduler', lambda: dict(self.recognition_scheduler.stats,
+                                                  depth=self.recognition_scheduler.depth()))
+        metrics.start_periodic_dump()
+
+        # The window and live feed are up; everything slow happens in the background
+        threading.Thread(target=self._load_in_background, daemon=True).start()
+
+    def _load_in_background(self):
+        try:
+            self._load_models_and_gallery()
+        except Exception as e:
+            # Formatted here: e is unbound once the except block ends
+            msg = f"Startup failed: {e}"
+            self.main_window.after(0, lambda: self.label_status.config(text=msg, fg="red"))
+            raise
+        self.main_window.after(0, self._on_ready)
+
+    def _load_models_and_gallery(self):
+        def step(name, fn):
+            start = time.perf_counter()
+            result = fn()
+            self.startup_timings[name] = time.perf_counter() - start
+            return result
+
+        self.embedding_store = step('open_store', lambda: open_store(self.db_dir))
+        # Both galleries wrap the store's memmaps; nothing is copied per user
+        self.gallery, self.avg_gallery = step('load_galleries', lambda: (
+            FaceGallery.from_store(self.embedding_store),
+            FaceGallery.from_store(self.embedding_store, use_avg=True)))
+
+        def build_indexes():
+            for name, gallery, params in (('gallery', self.gallery, dict(nlist=256, nprobe=16)),
+                                          ('avg_gallery', self.avg_gallery,
+                                           dict(nlist=64, nprobe=8, recall_tolerance=0.43))):
+                if len(gallery) >= self.ann_min_gallery_size:
+                    index = gallery.build_index(min_recall=1.0, **params)
+                    print(f"{name} IVF index {'on' if index else 'off'}: {gallery.index_report}")
+        step('build_indexes', build_indexes)
+
+        if self.gallery_precision:
+            step('quantize', lambda: (self.gallery.quantize(self.gallery_precision),
+                                      self.avg_gallery.quantize(self.gallery_precision)))
+
+        frame = self.most_recent_capture_arr
+        step('model_warm_up', lambda: util.warm_up(frame.shape if frame is not None else (480, 640, 3)))
+
+    def _on_ready(self):
+        self.ready = True
+        self.startup_timings['ready'] = time.perf_counter() - _process_start
+        for button in (self.login_button_main_window, self.logout_button_main_window,
+                       self.register_new_user_button_main_window):
+            button.config(state='normal')
+        self.label_status.destroy()
+
+        print("startup: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.startup_timings.items()))
+        if self.startup_report:
+            with open(self.startup_report, 'w') as f:
+                json.dump(self.startup_timings, f, indent=4)
+        if self.exit_when_ready:
+            self.on_closing()
+
+    def add_webcam(self, label, source=0):
+        # A single capture thread owns the device; every consumer reads from its ring buffer
+        self.frame_grabber = FrameGrabber(open_source(source)).start()
         self._label = label
+        # Draws at label size into one reused PhotoImage, throttled while recognition runs
+        self.preview = PreviewRenderer(label)
+        self._last_preview_id = 0
+        self.most_recent_capture_arr = None
         self.process_webcam()
 
     def process_webcam(self):
-        ret, frame = self.cap.read()
-        if ret:
+        frame_id, frame = self.frame_grabber.latest()
+        if frame_id != self._last_preview_id:
+            self._last_preview_id = frame_id
             self.most_recent_capture_arr = frame
-            img_ = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            self.most_recent_capture_pil = Image.fromarray(img_)
-            imgtk = ImageTk.PhotoImage(image=self.most_recent_capture_pil)
-            self._label.imgtk = imgtk
-            self._label.configure(image=imgtk)
+            if self.current_user is not None:
+                was_tracking = self.face_tracker.tracking
+                self.face_tracker.observe(frame)
+                self.motion_gate.observe(frame)
+                if was_tracking and not self.face_tracker.tracking:
+                    # The face left or was occluded: check right away
+                    self.motion_gate.trigger()
+            if self.preview.render(frame) and 'first_frame' not in self.startup_timings:
+                self.startup_timings['first_frame'] = time.perf_counter() - _process_start
         self._label.after(20, self.process_webcam)
 
-    def login(self):
-        def login_task():
-            if self.current_user is not None:
-                util.msg_box("Already Logged In", f"User '{self.current_user}' is already logged in.")
+    def _submit_recognition(self, key, fn, priority, on_result=None, group=None):
+        """
+        Runs fn on the recognition scheduler; on_result gets its return value on
+        the Tk thread. Requests the scheduler drops never call back. Without
+        on_result, a failure is only logged.
+        """
+        future = self.recognition_scheduler.submit(key, fn, priority, group)
+
+        def done(f):
+            if f.cancelled():
+                return
+            error = f.exception()
+            if error is not None:
+                print(f"Recognition {key[0]} failed:")
+                traceback.print_exception(type(error), error, error.__traceback__)
+                if on_result is not None:
+                    self.main_window.after(0, lambda: util.msg_box("Error", f"Recognition failed: {error}"))
                 return
+            if on_result is not None:
+                self.main_window.after(0, lambda: on_result(f.result()))
+        future.add_done_callback(done)
+        return future
+
+    def _interactive_pending(self):
+        # A button press while the previous login/logout check is still running is ignored
+        return self._interactive_request is not None and not self._interactive_request.done()
 
-            status, name_or_id = util.recognize(
-                self.most_recent_capture_arr,
-                self.db_dir,
-                self.known_encodings,
-                self.known_names
-            )
+    def login(self):
+        if self._interactive_pending():
+            return
+        frame_id, frame = self._last_preview_id, self.most_recent_capture_arr
+
+        if self.multi_person:
+            self._interactive_request = self._submit_recognition(
+                ('recognize_all', frame_id), lambda: self._timed_recognize_all('login', frame),
+                PRIORITY_INTERACTIVE, self.login_users_in_view)
+            return
 
+        if self.current_user is not None:
+            util.msg_box("Already Logged In", f"User '{self.current_user}' is already logged in.")
+            return
+
+        def recognize():
+            with timed('login'), self.preview.busy():
+                return util.recognize(
+                    frame,
+                    self.db_dir,
+                    avg_gallery=self.avg_gallery
+                )
+
+        def on_result(result):
+            status, name_or_id = result
             if status == 'no_persons_found':
                 util.msg_box("Error", "No face detected. Please try again.")
             elif status == 'multiple_faces_detected':
                 util.msg_box("Error", "Multiple faces detected. Ensure only one person is in front of the camera.")
             elif status == 'unknown_person':
                 util.msg_box("Error", "Face not recognized. Please register first.")
+            elif self.current_user is not None:
+                util.msg_box("Already Logged In", f"User '{self.current_user}' is already logged in.")
             else:
                 name = status
                 emp_id = name_or_id
-                util.msg_box('Welcome back!', f'Welcome, {name} (ID: {emp_id}).')
-                with open(self.log_path, 'a') as f:
-                    f.write(f'{name},{emp_id},{datetime.datetime.now()},in\n')
+                self.attendance_store.record(name, emp_id, 'in')
                 self.current_user = name
                 self.logged_in_emp_ids.add(emp_id)
+                start_attendance([name])
                 self.run_timer_updates()
+                util.msg_box('Welcome back!', f'Welcome, {name} (ID: {emp_id}).')
 
-        threading.Thread(target=login_task).start()
+        self._interactive_request = self._submit_recognition(
+            ('recognize', frame_id), recognize, PRIORITY_INTERACTIVE, on_result)
 
     def update_register_video_feed(self):
+        if not self.register_new_user_window.winfo_exists():
+            self.running_register_feed = False
         if not self.running_register_feed:
+            # The main window's preview is hidden behind this one while it is open
+            self.preview.paused = False
             return
+        self.preview.paused = True
 
-        ret, frame = self.cap.read()
-        if ret:
-            self.register_frame = frame.copy()
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pil_img = Image.fromarray(frame_rgb)
-            imgtk = ImageTk.PhotoImage(image=pil_img)
-            self.capture_label.imgtk = imgtk
-            self.capture_label.configure(image=imgtk)
+        frame_id, frame = self.frame_grabber.latest()
+        if frame is not None and frame_id != self._last_register_preview_id:
+            self._last_register_preview_id = frame_id
+            self.register_frame = frame
+            self.register_preview.render(frame)
 
         # Repeat every 50ms
         self.register_new_user_window.after(50, self.update_register_video_feed)
 
     def logout(self):
-        def logout_task():
-            if self.current_user is None:
+        if self._interactive_pending():
+            return
+        frame_id, frame = self._last_preview_id, self.most_recent_capture_arr
+
+        if self.multi_person:
+            if not self.logged_in_users:
                 util.msg_box("Error", "No user is currently logged in.")
                 return
+            self._interactive_request = self._submit_recognition(
+                ('recognize_all', frame_id), lambda: self._timed_recognize_all('logout', frame),
+                PRIORITY_INTERACTIVE, self.logout_users_in_view)
+            return
 
-            # Recognize who is in front of the camera
-            status, name_or_id = util.recognize(
-                self.most_recent_capture_arr,
-                self.db_dir,
-                self.known_encodings,
-                self.known_names
-            )
+        if self.current_user is None:
+            util.msg_box("Error", "No user is currently logged in.")
+            return
+        user = self.current_user
+
+        def verify():
+            # Check the face against the logged-in user only; identify it just to explain a mismatch
+            with timed('logout'), self.preview.busy():
+                return util.verify(
+                    frame,
+                    user,
+                    self.db_dir,
+                    self.gallery,
+                    identify_on_mismatch=True,
+                    avg_gallery=self.avg_gallery
+                )
 
+        def on_result(result):
+            status, name_or_id = result
             if status == 'no_persons_found':
                 util.msg_box("Error", "No face detected. Please try again.")
                 return
@@ -165,31 +363,101 @@ class App:
             # Proceed with logout
             name = status
             emp_id = name_or_id
-            util.msg_box("Hasta la vista!", f"Goodbye, {name} (ID: {emp_id}).")
-            with open(self.log_path, 'a') as f:
-                f.write(f'{name},{emp_id},{datetime.datetime.now()},out\n')
+            self.attendance_store.record(name, emp_id, 'out')
 
             if emp_id in self.logged_in_emp_ids:
                 self.logged_in_emp_ids.remove(emp_id)
 
-            if self.update_timers_job:
-                self.main_window.after_cancel(self.update_timers_job)
-                self.update_timers_job = None
+            stop_attendance([name])
+            self.end_session()
+            util.msg_box("Hasta la vista!", f"Goodbye, {name} (ID: {emp_id}).")
 
-            self.current_user = None
-            self.label_present_time.config(text="Present: 0s")
-            self.label_absent_time.config(text="Absent: 0s")
-            self.label_total_missed.config(text="Total Missed: 0s")
+        self._interactive_request = self._submit_recognition(
+            ('verify', user, frame_id), verify, PRIORITY_INTERACTIVE, on_result)
 
-            # Remove name and ID labels from UI
-            if hasattr(self, 'label_name'):
-                self.label_name.destroy()
-                del self.label_name
-            if hasattr(self, 'label_emp_id'):
-                self.label_emp_id.destroy()
-                del self.label_emp_id
+    def end_session(self):
+        if self.update_timers_job:
+            self.main_window.after_cancel(self.update_timers_job)
+            self.update_timers_job = None
 
-        threading.Thread(target=logout_task).start()
+        stop_attendance([name for name in [self.current_user, *self.logged_in_users] if name is not None])
+        self.current_user = None
+        print(self.face_tracker.report())
+        print(self.motion_gate.report())
+        print(self.recognition_scheduler.report())
+        self.face_tracker.reset()
+        self.motion_gate.reset()
+        self.label_present_time.config(text="Present: 0s")
+        self.label_absent_time.config(text="Absent: 0s")
+        self.label_total_missed.config(text="Total Missed: 0s")
+
+        # Remove name and ID labels from UI
+        if hasattr(self, 'label_name'):
+            self.label_name.destroy()
+            del self.label_name
+        if hasattr(self, 'label_emp_id'):
+            self.label_emp_id.destroy()
+            del self.label_emp_id
+
+    def _timed_recognize_all(self, stage, frame):
+        with timed(stage):
+            return self.recognize_users_in_view(frame)
+
+    def recognize_users_in_view(self, frame, detector='hog'):
+        with self.preview.busy():
+            results = util.recognize_all(frame, self.db_dir, self.gallery, detector=detector)
+        return [(name, emp_id) for name, emp_id, _ in results if name != 'unknown_person'], len(results)
+
+    def login_users_in_view(self, result):
+        known, faces = result
+        if faces == 0:
+            util.msg_box("Error", "No face detected. Please try again.")
+            return
+        if not known:
+            util.msg_box("Error", "Face not recognized. Please register first.")
+            return
+
+        new_users = [(name, emp_id) for name, emp_id in known if name not in self.logged_in_users]
+        if not new_users:
+            util.msg_box("Already Logged In", "Everyone in view is already logged in.")
+            return
+
+        was_running = bool(self.logged_in_users)
+        for name, emp_id in new_users:
+            self.attendance_store.record(name, emp_id, 'in')
+            self.logged_in_users[name] = emp_id
+            self.logged_in_emp_ids.add(emp_id)
+        start_attendance([name for name, _ in new_users])
+        # Newcomers are not in the carried presence result yet
+        self.last_seen_names.extend(name for name, _ in new_users)
+
+        # The timer labels follow the most recently logged-in user
+        self.current_user = new_users[-1][0]
+        util.msg_box('Welcome back!', "Welcome, " + ", ".join(f"{n} (ID: {e})" for n, e in new_users) + ".")
+        if not was_running:
+            self.run_timer_updates()
+
+    def logout_users_in_view(self, result):
+        known, faces = result
+        leaving = [(name, emp_id) for name, emp_id in known if name in self.logged_in_users]
+        if faces == 0:
+            util.msg_box("Error", "No face detected. Please try again.")
+            return
+        if not leaving:
+            util.msg_box("Error", "No logged-in user recognized. Logout denied.")
+            return
+
+        for name, emp_id in leaving:
+            self.attendance_store.record(name, emp_id, 'out')
+            del self.logged_in_users[name]
+            self.logged_in_emp_ids.discard(emp_id)
+        stop_attendance([name for name, _ in leaving])
+        util.msg_box("Hasta la vista!", "Goodbye, " + ", ".join(f"{n} (ID: {e})" for n, e in leaving) + ".")
+
+        if not self.logged_in_users:
+            self.end_session()
+        elif self.current_user not in self.logged_in_users:
+            self.current_user = next(iter(self.logged_in_users))
 
     def run_timer_updates(self):
         def update():
@@ -197,44 +465,68 @@ class App:
                 return  # No user logged in
 
             def threaded_recognition():
-                status, emp_id_detected = util.recognize(
-                    self.most_recent_capture_arr,
-                    self.db_dir,
-                    use_multi_encodings=True  # New flag
-                )
-
-                is_present = (status == self.current_user)
-
-                # Update attendance
-                update_attendance(self.current_user, is_present)
+                # Read once: a logout on the Tk thread may end the session while this tick runs
+                user = self.current_user
+                if user is None:
+                    return
+                with timed('presence_tick'):
+                    frame = self.most_recent_capture_arr
+                    # On a static scene the last result still holds; the presence engine
+                    # accounts the elapsed time either way
+                    check = self.motion_gate.should_check()
+                    if self.multi_person:
+                        if check:
+                            # One detection/encoding pass for everyone in view, then update all sessions
+                            known, _ = self.recognize_users_in_view(frame, self.presence_detector)
+                            self.last_seen_names = [name for name, _ in known]
+                            self.motion_gate.confirm(frame)
+                        update_attendance_many(self.last_seen_names)
+                    else:
+                        if check:
+                            # The tracker only re-runs detection/encoding when the face track needs it,
+                            # and then only a 1:1 check against the current user
+                            with self.preview.busy():
+                                status, emp_id_detected = self.face_tracker.recognize(
+                                    frame,
+                                    lambda encoding: util.verify_encoding(
+                                        encoding,
+                                        user,
+                                        self.db_dir,
+                                        self.gallery
+                                    )
+                                )
+                            self.last_presence = (status == user)
+                            self.motion_gate.confirm(frame)
+                        is_present = self.last_presence
+
+                        # Update attendance
+                        update_attendance(user, is_present)
+                        incr('presence_seen' if is_present else 'presence_missing')
 
                 # Get updated timer data
-                timers = get_user_timer_data(self.current_user)
+                timers = get_user_timer_data(user)
                 present = timers['presentCounter']
                 absent = timers['absentCounter']
                 missed = timers['absentTimeCounter']
 
-                # Get emp_id from the user JSON
-                try:
-                    with open(self.users_file_path, 'r') as f:
-                        users_data = json.load(f)
-                        emp_id = users_data.get(self.current_user, "N/A")
-                except:
-                    emp_id = "N/A"
+                # Get emp_id from the cached user directory
+                emp_id = self.user_directory.emp_id_for(user)
 
                 # Update all labels (must be run on main thread)
                 def update_ui():
+                    if self.current_user != user:
+                        return  # Logged out or switched while the tick ran
                     self.label_present_time.config(text=f"Present: {present}s")
                     self.label_absent_time.config(text=f"Absent: {absent}s")
                     self.label_total_missed.config(text=f"Total Missed: {missed}s")
 
                     # Add name and ID if not already shown
                     if not hasattr(self, 'label_name'):
-                        self.label_name = tk.Label(self.main_window, text=f"Name: {self.current_user}",
+                        self.label_name = tk.Label(self.main_window, text=f"Name: {user}",
                                                    font=("Helvetica", 12))
                         self.label_name.place(x=750, y=120)
                     else:
-                        self.label_name.config(text=f"Name: {self.current_user}")
+                        self.label_name.config(text=f"Name: {user}")
 
                     if not hasattr(self, 'label_emp_id'):
                         self.label_emp_id = tk.Label(self.main_window, text=f"Emp ID: {emp_id}", font=("Helvetica", 12))
@@ -248,15 +540,18 @@ class App:
                             self.last_alert_threshold = 0
 
                         if missed > self.last_alert_threshold and missed % 30 == 0:
-                            util.msg_box("Warning!", f"{self.current_user} has been absent for {missed} seconds!")
+                            util.msg_box("Warning!", f"{user} has been absent for {missed} seconds!")
                             self.last_alert_threshold = missed
 
                 self.main_window.after(0, update_ui)
 
-                # Schedule the next update
-                self.update_timers_job = self.main_window.after(5000, update)
-
-            threading.Thread(target=threaded_recognition).start()
+            # Ticks keep a fixed cadence however long a check takes; a tick still queued when the
+            # next one arrives is superseded, so presence checks never pile up behind login/logout
+            self.update_timers_job = self.main_window.after(self.presence_poll_interval, update)
+            if self._presence_request is not None and self._presence_request.running():
+                return  # Ticks never overlap: the tracker and presence state are updated in order
+            self._presence_request = self._submit_recognition(
+                ('presence', self._last_preview_id), threaded_recognition, PRIORITY_BACKGROUND, group='presence')
 
         # Reset alert flag for new session
         self.alert_shown = False
@@ -265,7 +560,11 @@ class App:
     def on_closing(self):
         if self.update_timers_job:
             self.main_window.after_cancel(self.update_timers_job)
-        self.cap.release()
+        self.frame_grabber.stop()
+        self.recognition_scheduler.close(wait=False)
+        self.attendance_store.close()
+        metrics.stop_periodic_dump()
+        presence_engine.snapshot(presence_engine.snapshot_path)
         self.main_window.destroy()
 
     def register_new_user(self):
@@ -304,6 +603,8 @@ class App:
 
         self.capture_label = util.get_img_label(self.register_new_user_window)
         self.capture_label.place(x=10, y=0, width=700, height=500)
+        self.register_preview = PreviewRenderer(self.capture_label, fps=15)
+        self._last_register_preview_id = 0
         self.running_register_feed = True
         self.update_register_video_feed()
 
@@ -340,7 +641,8 @@ class App:
         self.register_new_user_window.destroy()
 
     def add_img_to_label(self, label):
-        imgtk = ImageTk.PhotoImage(image=self.most_recent_capture_pil)
+        imgtk = ImageTk.PhotoImage(image=Image.fromarray(cv2.cvtColor(self.most_recent_capture_arr,
+                                                                      cv2.COLOR_BGR2RGB)))
         label.imgtk = imgtk
         label.configure(image=imgtk)
         self.register_new_user_capture = self.most_recent_capture_arr.copy()
@@ -353,20 +655,11 @@ class App:
             util.msg_box("Error", "Name and Emp ID cannot be empty!")
             return
 
-        users_file = self.users_file_path
-        users_data = {}
-        if os.path.exists(users_file) and os.path.getsize(users_file) > 0:
-            with open(users_file, 'r') as f:
-                try:
-                    users_data = json.load(f)
-                except json.JSONDecodeError:
-                    users_data = {}
-
-        if name in users_data:
+        if name in self.user_directory:
             util.msg_box("Error", f"Username '{name}' is already taken!")
             return
 
-        if emp_id in users_data.values():
+        if self.user_directory.has_emp_id(emp_id):
             util.msg_box("Error", f"Emp ID '{emp_id}' is already registered!")
             return
 
@@ -376,6 +669,10 @@ class App:
 
         self.capture_count = 0
         self.total_captures = 30
+        self.registration_capture_interval = 0.3
+        self.archive_registration_images = True
+        # Keep a few representative encodings instead of all 30 near-duplicates
+        self.registration_prototypes = 8
         self.capture_user_dir = user_dir
 
         # Label for progress
@@ -387,15 +684,24 @@ class App:
         threading.Thread(target=self.capture_images_for_registration, args=(name, emp_id)).start()
 
     def capture_images_for_registration(self, name, emp_id):
+        with timed('registration'):
+            self._capture_and_enroll(name, emp_id)
+
+    def _capture_and_enroll(self, name, emp_id):
         saved = 0
         max_count = self.total_captures
+        archive_dir = self.capture_user_dir if self.archive_registration_images else None
+        pipeline = EnrollmentPipeline(archive_dir=archive_dir, prototypes=self.registration_prototypes)
+        frame_id = 0
         while saved < max_count:
-            ret, frame = self.cap.read()
-            if not ret:
+            frame_id, frame = self.frame_grabber.wait_next(frame_id)
+            if frame is None:
                 continue
 
             # Detect face
-            face_locations = face_recognition.face_locations(frame)
+            with timed('registration_detect'):
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                face_locations = util.detect_faces(frame, detector=self.enrollment_detector)
             if len(face_locations) != 1:
                 self.register_new_user_window.after(0, lambda:
                 self.label_capture_status.config(text="Ensure only one face is visible")
@@ -403,54 +709,27 @@ class App:
                 time.sleep(0.5)
                 continue
 
-            img_path = os.path.join(self.capture_user_dir, f'{saved}.jpg')
-            cv2.imwrite(img_path, frame)
+            # Encode on the worker pool while we keep capturing
+            pipeline.submit(rgb_frame, face_locations[0], frame)
             saved += 1
 
             self.register_new_user_window.after(0, lambda count=saved:
             self.label_capture_status.config(text=f"Capturing image {count}/{max_count}")
                                                 )
-            time.sleep(0.6)
+            time.sleep(self.registration_capture_interval)
+
+        avg_encoding, encodings = pipeline.finish()
 
         # Save user data
-        users_file = self.users_file_path
-        if os.path.exists(users_file):
-            with open(users_file, 'r') as f:
-                try:
-                    users_data = json.load(f)
-                except:
-                    users_data = {}
-        else:
-            users_data = {}
-
-        users_data[name] = emp_id
-        with open(users_file, 'w') as f:
-            json.dump(users_data, f, indent=4)
-
-        # Compute average encoding from all valid face encodings
-        encodings = []
-        for i in range(self.total_captures):
-            img_path = os.path.join(self.capture_user_dir, f'{i}.jpg')
-            img = cv2.imread(img_path)
-            if img is None:
-                continue
-            face_encs = face_recognition.face_encodings(img)
-            if face_encs:
-                encodings.append(face_encs[0])
+        self.user_directory.add(name, emp_id)
 
         if encodings:
-            avg_encoding = np.mean(encodings, axis=0)
-            enc_path = os.path.join(self.capture_user_dir, 'avg_encoding.pkl')
-            with open(enc_path, 'wb') as f:
-                pickle.dump(avg_encoding, f)
-
-        # Save all encodings as multi_encodings.pkl
-        multi_path = os.path.join(self.capture_user_dir, 'multi_encodings.pkl')
-        with open(multi_path, 'wb') as f:
-            pickle.dump(encodings, f)
+            # Append to the shared embedding store instead of per-user pickle files
+            self.embedding_store.add_user(name, avg_encoding, encodings)
 
-        # Reload known encodings
-        self.known_encodings, self.known_names, self.multi_encodings_dict = util.load_known_faces(self.db_dir)
+            # Add the new user to the in-memory galleries instead of rescanning db_dir
+            self.gallery.add_user(name, encodings)
+            self.avg_gallery.add_user(name, avg_encoding)
 
         # Notify and close
         self.register_new_user_window.after(0, lambda: util.msg_box(
@@ -465,5 +744,23 @@ class App:
 
 
 if __name__ == "__main__":
-    app = App()
+    parser = argparse.ArgumentParser(description="Face Recognition Attendance System")
+    parser.add_argument('--source', default='0',
+                        help="Webcam index, video file or image directory to read frames from")
+    parser.add_argument('--multi-person', action='store_true',
+                        help="Let several people log in and track all of them with one camera")
+    parser.add_argument('--startup-report', metavar='PATH', help="Write startup timings (seconds) as JSON")
+    parser.add_argument('--exit-when-ready', action='store_true',
+                        help="Quit as soon as startup finishes, for measuring cold-start time")
+    parser.add_argument('--gallery-precision', choices=['float16', 'int8'],
+                        help="Search a reduced-precision copy of the galleries (exact float32 re-ranking)")
+    parser.add_argument('--presence-detector', choices=sorted(DETECTORS), default='hog',
+                        help="Face detector for the periodic presence checks")
+    parser.add_argument('--enrollment-detector', choices=sorted(DETECTORS), default='hog',
+                        help="Face detector for registration captures")
+    args = parser.parse_args()
+
+    app = App(args.source, multi_person=args.multi_person, startup_report=args.startup_report,
+              exit_when_ready=args.exit_when_ready, gallery_precision=args.gallery_precision,
+              presence_detector=args.presence_detector, enrollment_detector=args.enrollment_detector)
     app.start()
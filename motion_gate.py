@@ -0,0 +1,81 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Decides whether a presence check needs a fresh recognition.
+
+    observe() is meant for every preview frame: it diffs a tiny blurred
+    grayscale copy of the frame against the one from the last confirmed
+    check. While fewer than motion_threshold of its pixels changed, the scene
+    is considered static and should_check() says no, so the caller can carry
+    the last result forward. Significant motion, an explicit trigger() (e.g. a
+    lost face track) or max_skip seconds without a check make the next
+    should_check() return True, but never sooner than min_interval after the
+    previous check.
+    """
+
+    def __init__(self, size=(64, 48), pixel_threshold=25, motion_threshold=0.02, min_interval=2.0, max_skip=30.0):
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.motion_threshold = motion_threshold
+        self.min_interval = min_interval
+        self.max_skip = max_skip
+        self.stats = {'checks_run': 0, 'checks_skipped': 0, 'motion_triggers': 0}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._reference = None
+            self._triggered = False
+            self._last_check = 0.0
+            self.motion = 0.0
+
+    def _small(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+    def observe(self, frame):
+        """Returns True when this frame newly crossed the motion threshold."""
+        with self._lock:
+            if self._reference is None or self._triggered:
+                return False
+            diff = cv2.absdiff(self._small(frame), self._reference)
+            self.motion = float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+            if self.motion >= self.motion_threshold:
+                self._triggered = True
+                self.stats['motion_triggers'] += 1
+                return True
+            return False
+
+    def trigger(self):
+        with self._lock:
+            self._triggered = True
+
+    def should_check(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            since_check = now - self._last_check
+            check = (self._reference is None or since_check >= self.max_skip
+                     or (self._triggered and since_check >= self.min_interval))
+            self.stats['checks_run' if check else 'checks_skipped'] += 1
+            return check
+
+    def confirm(self, frame, now=None):
+        """Makes the frame a fresh check was run on the new static reference."""
+        small = self._small(frame)
+        with self._lock:
+            self._reference = small
+            self._triggered = False
+            self._last_check = time.time() if now is None else now
+            self.motion = 0.0
+
+    def report(self):
+        s = self.stats
+        return (f"motion gate: {s['checks_skipped']} presence checks skipped, {s['checks_run']} run, "
+                f"{s['motion_triggers']} motion triggers")
@@ -0,0 +1,214 @@
+import argparse
+import collections
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import util
+from attendance_store import AttendanceStore
+from embedding_store import EmbeddingStore, open_store, store_dir_for
+from frame_source import FrameGrabber, open_source
+from gallery import FaceGallery
+from timing_counters import engine, get_user_timer_data, start_attendance, stop_attendance, update_attendance_many
+
+# Per-process state of recognition workers
+_worker = {}
+
+
+def _init_worker(db_dir, detection_scale):
+    # The gallery wraps the memory-mapped embedding store, so every worker
+    # shares the same read-only pages instead of holding its own copy.
+    # The store already exists (start() creates it); workers never write to it.
+    _worker['db_dir'] = db_dir
+    _worker['gallery'] = FaceGallery.from_store(EmbeddingStore(store_dir_for(db_dir)))
+    _worker['detection_scale'] = detection_scale
+
+
+def _recognize_frame(frame):
+    results = util.recognize_all(frame, _worker['db_dir'], _worker['gallery'], _worker['detection_scale'])
+    return [(name, emp_id) for name, emp_id, _ in results]
+
+
+class CameraStats:
+    def __init__(self):
+        self.frames_seen = 0
+        self.frames_dropped = 0
+        self.frames_processed = 0
+        self.latencies = collections.deque(maxlen=1000)
+        self.started = time.time()
+
+    def summary(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            'frames_seen': self.frames_seen,
+            'frames_dropped': self.frames_dropped,
+            'frames_processed': self.frames_processed,
+            'processed_fps': self.frames_processed / elapsed,
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p99_ms': float(np.percentile(latencies, 99)),
+        }
+
+
+class MultiCameraPipeline:
+    """
+    Runs several frame sources into a shared process pool of recognition
+    workers.
+
+    Each camera has its own FrameGrabber (which keeps only the newest frames)
+    and at most max_in_flight frames queued in the pool; frames that arrive
+    while a camera is at its limit are dropped as stale, so nothing queues
+    unboundedly. Recognized names from all cameras are merged and fed into
+    timing_counters every tick_interval seconds for the tracked users: the
+    given tracked_users, or else everyone the attendance store in
+    attendance_root currently has logged in. With snapshot_path set, the
+    presence counters are saved there periodically and on stop().
+    """
+
+    def __init__(self, sources, db_dir='face_db', workers=None, max_in_flight=2, tick_interval=5.0,
+                 tracked_users=None, detection_scale=1.0, attendance_root='attendance', snapshot_path=None):
+        self.sources = list(sources)
+        self.db_dir = db_dir
+        self.workers = workers or os.cpu_count()
+        self.max_in_flight = max_in_flight
+        self.tick_interval = tick_interval
+        self.tracked_users = tracked_users
+        self.detection_scale = detection_scale
+        self.attendance_root = attendance_root
+        self.snapshot_path = snapshot_path
+        self._attendance_store = None
+
+        # Keyed by position: the same source may be listed twice
+        self.stats = [CameraStats() for _ in self.sources]
+        self._in_flight = [0] * len(self.sources)
+        self._seen_names = set()
+        self._accounted = set()
+        self._lock = threading.Lock()
+        self._running = False
+        self._threads = []
+        self._grabbers = []
+        self._pool = None
+
+    def start(self):
+        # Migrate or create the embedding store once, before workers open it concurrently
+        open_store(self.db_dir)
+        if self.tracked_users is None:
+            self._attendance_store = AttendanceStore(self.attendance_root, fsync=False)
+        if self.snapshot_path:
+            engine.snapshot_path = self.snapshot_path
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                         initargs=(self.db_dir, self.detection_scale))
+        self._running = True
+        for camera, source in enumerate(self.sources):
+            grabber = FrameGrabber(open_source(source)).start()
+            self._grabbers.append(grabber)
+            thread = threading.Thread(target=self._feed, args=(camera, grabber), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        tick_thread = threading.Thread(target=self._tick, daemon=True)
+        tick_thread.start()
+        self._threads.append(tick_thread)
+        return self
+
+    def stop(self):
+        self._running = False
+        for thread in self._threads:
+            thread.join(timeout=2)
+        for grabber in self._grabbers:
+            grabber.stop()
+        self._pool.shutdown()
+        if self._attendance_store is not None:
+            self._attendance_store.close()
+        if self.snapshot_path:
+            engine.snapshot(self.snapshot_path)
+
+    def _feed(self, camera, grabber):
+        stats = self.stats[camera]
+        frame_id = 0
+        while self._running:
+            frame_id, frame = grabber.wait_next(frame_id, timeout=0.5)
+            if frame is None:
+                continue
+            stats.frames_seen += 1
+            with self._lock:
+                if self._in_flight[camera] >= self.max_in_flight:
+                    stats.frames_dropped += 1
+                    continue
+                self._in_flight[camera] += 1
+
+            captured_at = time.perf_counter()
+            future = self._pool.submit(_recognize_frame, frame)
+            future.add_done_callback(lambda f, c=camera, t=captured_at: self._on_result(c, t, f))
+
+    def _on_result(self, camera, captured_at, future):
+        stats = self.stats[camera]
+        with self._lock:
+            self._in_flight[camera] -= 1
+            if future.cancelled() or future.exception() is not None:
+                return
+            stats.frames_processed += 1
+            stats.latencies.append(time.perf_counter() - captured_at)
+            self._seen_names.update(name for name, _ in future.result() if name != 'unknown_person')
+
+    def _tick(self):
+        next_tick = time.time() + self.tick_interval
+        while self._running:
+            time.sleep(min(0.2, max(next_tick - time.time(), 0)))
+            if time.time() < next_tick:
+                continue
+            next_tick += self.tick_interval
+            with self._lock:
+                seen, self._seen_names = self._seen_names, set()
+            users = self._tracked()
+            start_attendance(list(users - self._accounted))
+            stop_attendance(list(self._accounted - users))
+            self._accounted = users
+            update_attendance_many(seen)
+
+    def _tracked(self):
+        if self.tracked_users is not None:
+            return set(self.tracked_users)
+        # Logins and logouts are recorded by the app, possibly in another process
+        self._attendance_store.refresh()
+        return {name for _, name in self._attendance_store.currently_in()}
+
+    def summary(self):
+        with self._lock:
+            return {f'{camera}:{source}': stats.summary()
+                    for camera, (source, stats) in enumerate(zip(self.sources, self.stats))}
+
+    def attendance(self):
+        """Presence counters of the users currently accounted."""
+        return {user: get_user_timer_data(user) for user in sorted(self._accounted)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monitor several cameras with a pool of recognition workers")
+    parser.add_argument('sources', nargs='+', help="Webcam indexes, video files or image directories")
+    parser.add_argument('--db', default='face_db')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-in-flight', type=int, default=2, help="Frames queued per camera before dropping")
+    parser.add_argument('--users', nargs='*',
+                        help="Users to account attendance for (default: everyone currently logged in)")
+    parser.add_argument('--attendance-root', default='attendance')
+    parser.add_argument('--snapshot', default=os.path.join('attendance', 'presence_multi.npz'),
+                        help="Where to save the presence counters")
+    parser.add_argument('--detection-scale', type=float, default=1.0)
+    parser.add_argument('--duration', type=float, default=60.0)
+    parser.add_argument('--report-every', type=float, default=10.0)
+    args = parser.parse_args()
+
+    pipeline = MultiCameraPipeline(args.sources, args.db, args.workers, args.max_in_flight,
+                                   tracked_users=args.users, detection_scale=args.detection_scale,
+                                   attendance_root=args.attendance_root, snapshot_path=args.snapshot).start()
+    end = time.time() + args.duration
+    try:
+        while time.time() < end:
+            time.sleep(min(args.report_every, max(end - time.time(), 0)))
+            print(json.dumps({'cameras': pipeline.summary(), 'attendance': pipeline.attendance()}, indent=4))
+    finally:
+        pipeline.stop()
@@ -0,0 +1,189 @@
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+
+# Absences shorter than this are forgiven and counted as present time
+GRACE_SECONDS = 30
+
+
+class PresenceEngine:
+    """
+    Presence/absence counters for many users in preallocated NumPy arrays.
+
+    Each user gets a slot. An observation advances the slot by the exact time
+    since its previous observation: present time grows while the user is seen;
+    absence accumulates otherwise, is credited back as present time if the user
+    returns within GRACE_SECONDS, and is moved to missed time in GRACE_SECONDS
+    chunks once it reaches that length. update_slots() applies one tick for any
+    number of slots with array operations only.
+
+    start_session()/end_session() mark when a user's accounting starts and
+    stops, so time between a logout and the next login is never credited.
+    The slots of open sessions are kept in an array; update_active() ticks all
+    of them, and given slot indexes (see slots_of) instead of user ids it is
+    array operations only.
+    """
+
+    def __init__(self, capacity=1024, snapshot_path=None, snapshot_interval=60.0):
+        self._slots = {}
+        self.user_ids = []
+        self.present = np.zeros(capacity)
+        self.absent = np.zeros(capacity)
+        self.missed = np.zeros(capacity)
+        self.last_update = np.zeros(capacity)
+        self.active = np.zeros(0, dtype=np.int64)
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._last_snapshot = time.time()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def _grow(self, needed):
+        capacity = len(self.present)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ('present', 'absent', 'missed', 'last_update'):
+            old = getattr(self, name)
+            new = np.zeros(capacity)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def slots_for(self, user_ids, now=None):
+        """Slot indexes for user_ids, allocating slots for new users."""
+        now = time.time() if now is None else now
+        with self._lock:
+            slots = np.empty(len(user_ids), dtype=np.int64)
+            for i, user_id in enumerate(user_ids):
+                slot = self._slots.get(user_id)
+                if slot is None:
+                    slot = len(self.user_ids)
+                    self._grow(slot + 1)
+                    self._slots[user_id] = slot
+                    self.user_ids.append(user_id)
+                    self.last_update[slot] = now
+                slots[i] = slot
+            return slots
+
+    def update_slots(self, slots, is_present, now=None):
+        now = time.time() if now is None else now
+        slots = np.asarray(slots, dtype=np.int64)
+        is_present = np.asarray(is_present, dtype=bool)
+        with self._lock:
+            elapsed = np.maximum(now - self.last_update[slots], 0.0)
+            absent = self.absent[slots]
+
+            here = slots[is_present]
+            here_absent = absent[is_present]
+            # Short absences are forgiven once the user is back
+            credit = np.where((here_absent > 0) & (here_absent < GRACE_SECONDS), here_absent, 0.0)
+            self.present[here] += credit + elapsed[is_present]
+            self.absent[here] = 0.0
+
+            away = slots[~is_present]
+            away_absent = absent[~is_present] + elapsed[~is_present]
+            chunks = np.floor(away_absent / GRACE_SECONDS)
+            self.missed[away] += chunks * GRACE_SECONDS
+            self.absent[away] = away_absent - chunks * GRACE_SECONDS
+
+            self.last_update[slots] = now
+        self._maybe_snapshot(now)
+
+    def start_session(self, user_ids, now=None):
+        """Starts accounting user_ids from now."""
+        now = time.time() if now is None else now
+        slots = self.slots_for(user_ids, now)
+        with self._lock:
+            self.last_update[slots] = now
+            self.absent[slots] = 0.0
+            self.active = np.union1d(self.active, slots)
+        return slots
+
+    def end_session(self, user_ids, now=None):
+        """Stops accounting user_ids; their counters are kept."""
+        now = time.time() if now is None else now
+        slots = self.slots_for(user_ids, now)
+        with self._lock:
+            self.last_update[slots] = now
+            self.absent[slots] = 0.0
+            self.active = np.setdiff1d(self.active, slots)
+
+    def slots_of(self, user_ids):
+        """Slot indexes of user_ids, -1 for users without one; callers can keep them for update_active()."""
+        with self._lock:
+            return np.fromiter(map(self._slots.get, user_ids, itertools.repeat(-1)), dtype=np.int64,
+                               count=len(user_ids))
+
+    def update_active(self, present, now=None):
+        """
+        One tick for every open session. present holds the users seen, as user
+        ids or as an integer array of slot indexes.
+        """
+        now = time.time() if now is None else now
+        if not (isinstance(present, np.ndarray) and present.dtype.kind in 'iu'):
+            present = self.slots_of(list(present))
+        with self._lock:
+            active = self.active
+            seen = np.zeros(len(self.present), dtype=bool)
+        seen[present[present >= 0]] = True
+        self.update_slots(active, seen[active], now)
+
+    def update_sessions(self, user_ids, is_present, now=None):
+        """Like update(), but users without an open session are ignored rather than given a slot."""
+        now = time.time() if now is None else now
+        slots = self.slots_of(user_ids)
+        with self._lock:
+            open_session = np.isin(slots, self.active)
+        self.update_slots(slots[open_session], np.asarray(is_present, dtype=bool)[open_session], now)
+
+    def update(self, user_ids, is_present, now=None):
+        now = time.time() if now is None else now
+        self.update_slots(self.slots_for(user_ids, now), is_present, now)
+
+    def get(self, user_id):
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return 0.0, 0.0, 0.0
+        return self.present[slot], self.absent[slot], self.missed[slot]
+
+    def _maybe_snapshot(self, now):
+        if self.snapshot_path and now - self._last_snapshot >= self.snapshot_interval:
+            self.snapshot(self.snapshot_path)
+            self._last_snapshot = now
+
+    def snapshot(self, path):
+        with self._lock:
+            count = len(self.user_ids)
+            data = {
+                'user_ids': np.array(self.user_ids, dtype=str),
+                'present': self.present[:count],
+                'absent': self.absent[:count],
+                'missed': self.missed[:count],
+                'last_update': self.last_update[:count],
+            }
+            tmp_path = path + '.tmp.npz'
+            np.savez(tmp_path, **data)
+            os.replace(tmp_path, path)
+
+    def restore(self, path, now=None):
+        """
+        Loads a snapshot. Time between the snapshot and now is not accounted:
+        every restored slot resumes from now.
+        """
+        now = time.time() if now is None else now
+        data = np.load(path)
+        with self._lock:
+            self.user_ids = [str(user_id) for user_id in data['user_ids']]
+            self._slots = {user_id: slot for slot, user_id in enumerate(self.user_ids)}
+            self._grow(len(self.user_ids))
+            count = len(self.user_ids)
+            for name in ('present', 'absent', 'missed'):
+                getattr(self, name)[:count] = data[name]
+            self.last_update[:count] = now
+            self.active = np.zeros(0, dtype=np.int64)
@@ -0,0 +1,133 @@
+import argparse
+import threading
+import time
+import tkinter as tk
+from contextlib import contextmanager
+
+import cv2
+from PIL import Image, ImageTk
+
+from frame_source import FrameGrabber, open_source
+
+
+class PreviewRenderer:
+    """
+    Draws camera frames into a Tk label at the label's size.
+
+    Frames larger than size are shrunk to fit (keeping their aspect ratio) in
+    one cv2.resize call before the BGR to RGB conversion, and pasted into a
+    PhotoImage that is allocated once and reused. render() drops frames to
+    stay under fps, under busy_fps while busy() is held (e.g. during
+    recognition), and never lets drawing take more than max_load of the time.
+    While paused, nothing is drawn.
+    """
+
+    def __init__(self, label, size=(700, 500), fps=25, busy_fps=5, max_load=0.25):
+        self.label = label
+        self.size = size
+        self.fps = fps
+        self.busy_fps = busy_fps
+        self.max_load = max_load
+        self.paused = False
+        self.stats = {'frames_rendered': 0, 'frames_dropped': 0, 'render_ms': 0.0}
+        self._photo = None
+        self._photo_size = None
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+        self._last_render = 0.0
+        self._render_seconds = 0.0
+
+    @contextmanager
+    def busy(self):
+        with self._busy_lock:
+            self._busy += 1
+        try:
+            yield
+        finally:
+            with self._busy_lock:
+                self._busy -= 1
+
+    def _min_interval(self):
+        fps = self.busy_fps if self._busy else self.fps
+        return max(1.0 / fps, self._render_seconds / self.max_load)
+
+    def prepare(self, frame):
+        """Frame resized to fit size and converted to RGB."""
+        height, width = frame.shape[:2]
+        scale = min(self.size[0] / width, self.size[1] / height)
+        # Only shrink; smaller frames are shown as they are, like before
+        if scale < 1.0:
+            frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_LINEAR)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def render(self, frame, now=None):
+        """Draws the frame unless it has to be dropped; returns whether it was drawn."""
+        now = time.perf_counter() if now is None else now
+        if self.paused or now - self._last_render < self._min_interval():
+            self.stats['frames_dropped'] += 1
+            return False
+
+        start = time.perf_counter()
+        image = Image.fromarray(self.prepare(frame))
+        if self._photo is None or self._photo_size != image.size:
+            self._photo = ImageTk.PhotoImage(image=image)
+            self._photo_size = image.size
+            self.label.imgtk = self._photo
+            self.label.configure(image=self._photo)
+        else:
+            self._photo.paste(image)
+        elapsed = time.perf_counter() - start
+
+        # Smoothed drawing cost, used to cap the preview's share of the CPU
+        self._render_seconds = elapsed if not self._render_seconds else 0.9 * self._render_seconds + 0.1 * elapsed
+        self._last_render = now
+        self.stats['frames_rendered'] += 1
+        self.stats['render_ms'] = self._render_seconds * 1000
+        return True
+
+
+def _legacy_render(label, frame):
+    # The previous process_webcam drawing: full-size conversion and a new PhotoImage per frame
+    imgtk = ImageTk.PhotoImage(image=Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+    label.imgtk = imgtk
+    label.configure(image=imgtk)
+
+
+def measure_cpu(source, seconds=10.0, poll_ms=20):
+    """CPU seconds per wall second spent by the legacy and the new preview path on the same source."""
+    root = tk.Tk()
+    label = tk.Label(root)
+    label.pack()
+    grabber = FrameGrabber(open_source(source)).start()
+    results = {}
+    try:
+        renderer = PreviewRenderer(label)
+        for name, draw in (('legacy', lambda frame: _legacy_render(label, frame)), ('renderer', renderer.render)):
+            last_id = 0
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            while time.perf_counter() - wall_start < seconds:
+                frame_id, frame = grabber.latest()
+                if frame_id != last_id:
+                    last_id = frame_id
+                    draw(frame)
+                root.update()
+                time.sleep(poll_ms / 1000)
+            results[name] = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+        results['renderer_stats'] = renderer.stats
+    finally:
+        grabber.stop()
+        root.destroy()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the CPU cost of the old and new preview paths")
+    parser.add_argument('--source', default='0', help="Webcam index, video file or image directory")
+    parser.add_argument('--seconds', type=float, default=10.0, help="Duration of each measurement")
+    args = parser.parse_args()
+
+    results = measure_cpu(args.source, args.seconds)
+    # The whole process is measured, so both figures include the capture thread
+    print(f"legacy preview:   {results['legacy'] * 100:.1f}% of a core")
+    print(f"renderer preview: {results['renderer'] * 100:.1f}% of a core")
+    print(f"renderer stats:   {results['renderer_stats']}")
@@ -0,0 +1,72 @@
+import argparse
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+from bench_utils import make_synthetic_db, time_stage
+from embedding_store import EmbeddingStore, store_dir_for
+from gallery import FaceGallery
+
+PRECISIONS = ('float16', 'int8')
+
+
+def check_quantization(db_dir, precisions=PRECISIONS, probes_per_level=200, tolerance=0.53, seed=1,
+                       index_params=None):
+    """
+    Reference check for reduced-precision galleries: stored encodings with
+    increasing noise (from clear matches to just past the tolerance) must get
+    the same match decision as with the float32 gallery. With index_params,
+    each precision is also checked on top of a strict IVF index (e.g.
+    {'nlist': 64, 'nprobe': 8}), whose candidates are then ranked on the codes.
+    """
+    store = EmbeddingStore(store_dir_for(db_dir))
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(store.multi[rng.integers(0, len(store.multi), probes_per_level)], dtype=np.float32)
+    probes = np.concatenate([rows + rng.normal(0, noise, rows.shape).astype(np.float32)
+                             for noise in (0.0, 0.02, 0.04, 0.046, 0.05, 0.1)])
+    reference = FaceGallery.from_store(store).match_batch(probes, tolerance)
+
+    result = {'probes': len(probes), 'matched': sum(name is not None for name in reference)}
+    variants = [(precision, None) for precision in precisions]
+    if index_params:
+        variants += [(precision, dict(index_params, strict=True)) for precision in precisions]
+    for precision, params in variants:
+        gallery = FaceGallery.from_store(store)
+        if params:
+            gallery.build_index(**params)
+        gallery.quantize(precision)
+        decisions = [gallery.match(probe, tolerance) for probe in probes]
+        result[precision + ('+ivf' if params else '')] = {
+            'mismatches': sum(a != b for a, b in zip(reference, decisions)),
+            'bytes': int(gallery._codes.nbytes),
+            'float32_bytes': int(len(gallery) * 128 * 4),
+            'match': time_stage(lambda: gallery.match(probes[0], tolerance), 20),
+        }
+    return result
+
+
+def run_check(users=100, per_user=30, index_params=None):
+    """check_quantization on a temporary synthetic gallery; returns (report, passed)."""
+    db_dir = tempfile.mkdtemp(prefix='bench_face_db_')
+    try:
+        make_synthetic_db(db_dir, users, per_user, pickles=False)
+        check = check_quantization(db_dir, index_params=index_params)
+    finally:
+        shutil.rmtree(db_dir)
+    passed = not any(value['mismatches'] for value in check.values() if isinstance(value, dict))
+    return check, passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify that float16/int8 galleries make the same match decisions")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--per-user', type=int, default=30)
+    parser.add_argument('--no-index', action='store_true', help="Skip the check on top of an IVF index")
+    args = parser.parse_args()
+
+    check, passed = run_check(args.users, args.per_user, None if args.no_index else {'nlist': 64, 'nprobe': 8})
+    print(json.dumps(check, indent=4))
+    if not passed:
+        raise SystemExit("Quantized gallery changed match decisions")
@@ -0,0 +1,163 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from instrumentation import metrics
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class _Job:
+    __slots__ = ('key', 'fn', 'priority', 'group', 'future', 'submitted', 'dropped')
+
+    def __init__(self, key, fn, priority, group):
+        self.key = key
+        self.fn = fn
+        self.priority = priority
+        self.group = group
+        self.future = Future()
+        self.submitted = time.perf_counter()
+        self.dropped = False
+
+
+class RecognitionScheduler:
+    """
+    Single place where recognition work runs, on a fixed number of workers.
+
+    submit(key, fn) returns a Future. A request whose key (e.g. the kind of
+    check plus the frame id) is already queued or running gets that job's
+    Future instead of running fn again. Interactive work (login/logout) is
+    always taken before background work (presence checks). A background job
+    submitted with a group replaces the queued, not yet started job of the same
+    group; background jobs are also dropped when they waited longer than
+    max_wait seconds, or refused while max_pending jobs are queued. Dropped
+    jobs' Futures are cancelled.
+    """
+
+    def __init__(self, workers=1, max_pending=8, max_wait=10.0):
+        self.max_pending = max_pending
+        self.max_wait = max_wait
+        self._heap = []
+        self._seq = itertools.count()
+        self._jobs = {}
+        self._groups = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {
+            'submitted': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'completed': 0,
+            'failed': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0,
+        }
+        self._workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, key, fn, priority=PRIORITY_INTERACTIVE, group=None):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Recognition scheduler is closed")
+            self.stats['submitted'] += 1
+            job = self._jobs.get(key)
+            if job is not None:
+                self.stats['coalesced'] += 1
+                return job.future
+
+            job = _Job(key, fn, priority, group)
+            if priority != PRIORITY_INTERACTIVE:
+                if group is not None and group in self._groups:
+                    self._drop(self._groups[group])
+                if self.depth() >= self.max_pending:
+                    self._drop(job)
+                    return job.future
+            self._jobs[key] = job
+            if group is not None:
+                self._groups[group] = job
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._cond.notify()
+            return job.future
+
+    def depth(self):
+        """Jobs queued and not yet started."""
+        with self._cond:
+            return sum(1 for _, _, job in self._heap if not job.dropped)
+
+    def _drop(self, job):
+        # Caller holds the lock; the heap entry is skipped when popped
+        job.dropped = True
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        if job.group is not None and self._groups.get(job.group) is job:
+            del self._groups[job.group]
+        job.future.cancel()
+        self.stats['dropped'] += 1
+        metrics.incr('scheduler_dropped')
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if not self._heap:
+                    return None
+                _, _, job = heapq.heappop(self._heap)
+                if job.dropped:
+                    continue
+                waited = time.perf_counter() - job.submitted
+                if job.priority != PRIORITY_INTERACTIVE and waited > self.max_wait:
+                    self._drop(job)
+                    continue
+                if job.group is not None and self._groups.get(job.group) is job:
+                    del self._groups[job.group]
+                self.stats['wait_ms_total'] += waited * 1000
+                self.stats['wait_ms_max'] = max(self.stats['wait_ms_max'], waited * 1000)
+                metrics.observe('scheduler_wait', waited)
+                job.future.set_running_or_notify_cancel()
+                return job
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                result = job.fn()
+            except Exception as e:
+                outcome = 'failed'
+                job.future.set_exception(e)
+            else:
+                outcome = 'completed'
+                job.future.set_result(result)
+            with self._cond:
+                self.stats[outcome] += 1
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+
+    def report(self):
+        with self._cond:
+            s = dict(self.stats)
+            depth = self.depth()
+        started = s['completed'] + s['failed']
+        mean_wait = s['wait_ms_total'] / started if started else 0.0
+        return (f"recognition scheduler: {s['submitted']} requests, {s['coalesced']} coalesced, "
+                f"{s['dropped']} dropped, {depth} queued, wait {mean_wait:.0f} ms mean / "
+                f"{s['wait_ms_max']:.0f} ms max")
+
+    def close(self, wait=True):
+        with self._cond:
+            self._closed = True
+            for _, _, job in self._heap:
+                if not job.dropped:
+                    self._drop(job)
+            self._heap = []
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import util
+from bench_detection import load_frames
+from gallery import FaceGallery
+from user_directory import get_user_directory
+
+HEADER = struct.Struct('>I')
+
+
+async def read_message(reader):
+    size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return await reader.readexactly(size)
+
+
+def write_message(writer, payload):
+    writer.write(HEADER.pack(len(payload)) + payload)
+
+
+class RecognitionServer:
+    """
+    Headless recognition service for thin camera clients.
+
+    Clients connect over a local TCP socket and send length-prefixed JPEG
+    frames; each gets a length-prefixed JSON reply with status, name, emp_id,
+    latency_ms and the size of the batch it was processed in. Requests that
+    arrive within batch_window seconds are grouped: detection and encoding of
+    the batch run on a worker pool, then every encoding is matched against the
+    gallery in one vectorized call.
+    """
+
+    def __init__(self, db_dir, host='127.0.0.1', port=8765, batch_window=0.01, max_batch=16,
+                 workers=None, detection_scale=1.0):
+        self.db_dir = db_dir
+        self.host = host
+        self.port = port
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.detection_scale = detection_scale
+        self.gallery = FaceGallery.from_db(db_dir)
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self._queue = None
+        self._server = None
+        self.stats = {'requests': 0, 'batches': 0}
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        asyncio.get_running_loop().create_task(self._batcher())
+        return self
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self._pool.shutdown()
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                payload = await read_message(reader)
+                result = await self.submit(payload)
+                write_message(writer, json.dumps(result).encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def submit(self, jpeg_bytes):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((jpeg_bytes, future, time.perf_counter()))
+        return await future
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            payloads = [item[0] for item in batch]
+            try:
+                results = await loop.run_in_executor(None, self._process_batch, payloads)
+            except Exception as e:
+                results = [{'status': 'error', 'error': str(e)}] * len(batch)
+
+            self.stats['batches'] += 1
+            self.stats['requests'] += len(batch)
+            now = time.perf_counter()
+            for (_, future, arrived), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(dict(result, latency_ms=(now - arrived) * 1000, batch_size=len(batch)))
+
+    def _detect(self, jpeg_bytes):
+        frame = cv2.imdecode(np.frombuffer(jpeg_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return 'invalid_image', None, None
+        return util.detect_and_encode(frame, self.detection_scale)
+
+    def _process_batch(self, payloads):
+        detections = list(self._pool.map(self._detect, payloads))
+        results = [{'status': status, 'name': None, 'emp_id': None} for status, _, _ in detections]
+
+        encoded = [i for i, (status, _, _) in enumerate(detections) if status is None]
+        if encoded:
+            names = self.gallery.match_batch([detections[i][2] for i in encoded])
+            users = get_user_directory(os.path.join(self.db_dir, 'users.json'))
+            for i, name in zip(encoded, names):
+                if name is None:
+                    results[i]['status'] = 'unknown_person'
+                else:
+                    results[i].update(status='recognized', name=name, emp_id=users.emp_id_for(name))
+        return results
+
+
+async def run_load_test(host, port, frames, clients=4, requests_per_client=25):
+    """Stand-in kiosk clients: each sends frames back to back and records latency."""
+    payloads = [cv2.imencode('.jpg', frame)[1].tobytes() for frame in frames]
+    latencies = []
+    batch_sizes = []
+
+    async def client(index):
+        reader, writer = await asyncio.open_connection(host, port)
+        for i in range(requests_per_client):
+            start = time.perf_counter()
+            write_message(writer, payloads[(index + i) % len(payloads)])
+            await writer.drain()
+            result = json.loads(await read_message(reader))
+            latencies.append((time.perf_counter() - start) * 1000)
+            batch_sizes.append(result['batch_size'])
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies)
+    return {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_batch_size': float(np.mean(batch_sizes)),
+    }
+
+
+async def _serve_and_load_test(args, frames):
+    server = await RecognitionServer(args.db, args.host, args.port, args.batch_window, args.max_batch).start()
+    report = await run_load_test(args.host, args.port, frames, args.clients, args.requests)
+    await server.close()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless face recognition server with micro-batching")
+    parser.add_argument('--db', default='face_db')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--batch-window', type=float, default=0.01, help="Seconds to wait for more requests")
+    parser.add_argument('--max-batch', type=int, default=16)
+    parser.add_argument('--load-test', metavar='FRAMES',
+                        help="Start the server plus local stand-in clients replaying frames from this "
+                             "directory or video, then print throughput and latency")
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=25, help="Requests per stand-in client")
+    args = parser.parse_args()
+
+    if args.load_test:
+        frames = load_frames(args.load_test, limit=50)
+        if not frames:
+            raise SystemExit(f"No frames found in {args.load_test}")
+        print(json.dumps(asyncio.run(_serve_and_load_test(args, frames)), indent=4))
+    else:
+        server = RecognitionServer(args.db, args.host, args.port, args.batch_window, args.max_batch)
+        print(f"Serving on {args.host}:{args.port}")
+        asyncio.run(server.serve_forever())
@@ -1,50 +1,36 @@
 import time
 
-# Dictionary to store timer values for each user
-userTimers = {}
+from presence_engine import PresenceEngine
 
-# Called when a user is recognized or not
+# Counters for every user, kept in arrays by the presence engine
+engine = PresenceEngine()
+
+# Called when a user is recognized or not; ignored once the user's session has ended
 def update_attendance(user_id, is_present):
-    if user_id not in userTimers:
-        userTimers[user_id] = {
-            'presentCounter': 0,
-            'absentCounter': 0,
-            'absentTimeCounter': 0,
-            'lastUpdateTime': time.time()
-        }
-
-    currentTime = time.time()
-    elapsedTime = currentTime - userTimers[user_id]['lastUpdateTime']
-
-    # Only update every 5 seconds
-    if elapsedTime >= 5:
-        timers = userTimers[user_id]
-
-        if is_present:
-            # If user was absent for < 30s, add that back to present time
-            if 0 < timers['absentCounter'] < 30:
-                timers['presentCounter'] += timers['absentCounter']
-            # Add the current 5 seconds of presence
-            timers['presentCounter'] += 5
-            # Reset absence counter
-            timers['absentCounter'] = 0
-        else:
-            # Accumulate absence
-            timers['absentCounter'] += 5
-            # If absence reaches 30s, count it as missed time
-            if timers['absentCounter'] >= 30:
-                timers['absentTimeCounter'] += 30
-                timers['absentCounter'] = 0  # reset
-
-        timers['lastUpdateTime'] = currentTime
+    # Every observation accounts for the exact time since the previous one
+    engine.update_sessions([user_id], [is_present], time.time())
+
+
+# Called at login/logout; time outside a session is never counted
+def start_attendance(user_ids):
+    engine.start_session(user_ids, time.time())
+
+
+def stop_attendance(user_ids):
+    engine.end_session(user_ids, time.time())
+
+
+# Called once per frame with the users seen in it (ids, or slot indexes from engine.slots_of);
+# updates every started session
+def update_attendance_many(present):
+    engine.update_active(present, time.time())
 
 
 # Get user timer data for UI display
 def get_user_timer_data(user_id):
-    if user_id in userTimers:
-        return userTimers[user_id]
+    present, absent, missed = engine.get(user_id)
     return {
-        'presentCounter': 0,
-        'absentCounter': 0,
-        'absentTimeCounter': 0
+        'presentCounter': int(present),
+        'absentCounter': int(absent),
+        'absentTimeCounter': int(missed)
     }
@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+
+_directories = {}
+_directories_lock = threading.Lock()
+
+
+class UserDirectory:
+    """
+    Cached view of users.json ({name: emp_id}) with a reverse emp_id index.
+
+    The file is parsed once and re-read only when its mtime or size changes;
+    that check itself runs at most every check_interval seconds, so lookups on
+    the recognition path do no file I/O. Updates are written atomically via a
+    temp file and rename.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._by_name = {}
+        self._by_emp_id = {}
+        self._signature = None
+        self._last_check = 0.0
+        self._reload()
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _reload(self):
+        signature = self._stat_signature()
+        users_data = {}
+        if signature is not None and signature[1] > 0:
+            try:
+                with open(self.path, 'r') as f:
+                    users_data = json.load(f)
+            except json.JSONDecodeError:
+                users_data = {}
+        self._by_name = dict(users_data)
+        self._by_emp_id = {emp_id: name for name, emp_id in users_data.items()}
+        self._signature = signature
+        self._last_check = time.time()
+
+    def _refresh(self):
+        now = time.time()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        if self._stat_signature() != self._signature:
+            self._reload()
+
+    def emp_id_for(self, name, default="N/A"):
+        with self._lock:
+            self._refresh()
+            return self._by_name.get(name, default)
+
+    def name_for(self, emp_id, default=None):
+        with self._lock:
+            self._refresh()
+            return self._by_emp_id.get(emp_id, default)
+
+    def __contains__(self, name):
+        with self._lock:
+            self._refresh()
+            return name in self._by_name
+
+    def has_emp_id(self, emp_id):
+        with self._lock:
+            self._refresh()
+            return emp_id in self._by_emp_id
+
+    def as_dict(self):
+        with self._lock:
+            self._refresh()
+            return dict(self._by_name)
+
+    def add(self, name, emp_id):
+        self.update({name: emp_id})
+
+    def update(self, users):
+        """Adds several users with a single atomic write of users.json."""
+        with self._lock:
+            # Pick up edits made by other processes before writing over them
+            self._last_check = 0.0
+            self._refresh()
+            users_data = dict(self._by_name)
+            users_data.update(users)
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(users_data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+            self._by_name = users_data
+            self._by_emp_id = {emp_id: name for name, emp_id in users_data.items()}
+            self._signature = self._stat_signature()
+
+
+def get_user_directory(path):
+    """Returns the shared UserDirectory for a users.json path."""
+    path = os.path.abspath(path)
+    with _directories_lock:
+        if path not in _directories:
+            _directories[path] = UserDirectory(path)
+        return _directories[path]
@@ -1,14 +1,46 @@
+import importlib.util
 import os
-import json
+import sys
 import tkinter as tk
 from tkinter import messagebox
-import face_recognition
 import cv2
 import numpy as np
-import pickle
 
-def match_face(current_encoding, known_encodings, known_names, tolerance=0.43):
-    if not known_encodings:
+from embedding_store import open_store
+from face_detectors import get_detector
+from gallery import FaceGallery
+from instrumentation import incr, timed
+from user_directory import get_user_directory
+
+
+def lazy_import(name):
+    """
+    Returns the module but defers executing it until an attribute is first
+    used. face_recognition loads its dlib models at import, which would
+    otherwise hold up startup.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+face_recognition = lazy_import('face_recognition')
+
+def match_face(current_encoding, known_encodings, known_names, tolerance=0.43, gallery=None):
+    if gallery is not None:
+        # The gallery holds the encodings as one matrix, with its own index if one was built
+        name = gallery.match(current_encoding, tolerance)
+        return "Unknown" if name is None else name
+
+    if len(known_encodings) == 0:
         return "Unknown"
 
     face_distances = face_recognition.face_distance(known_encodings, current_encoding)
@@ -55,89 +87,182 @@ def get_entry_text(window):
 def msg_box(title, description):
     messagebox.showinfo(title, description)
 
-def recognize(frame, db_dir, known_encodings=None, known_names=None, use_multi_encodings=False):
+def warm_up(frame_shape=(480, 640, 3)):
+    """Loads the face_recognition models and runs one detection and encoding."""
+    frame = np.zeros(frame_shape, dtype=np.uint8)
+    detect_faces(frame)
+    height, width = frame_shape[:2]
+    encode_face_crop(frame, (height // 4, width * 3 // 4, height * 3 // 4, width // 4))
+
+def detect_faces(frame, detection_scale=1.0, detector='hog'):
+    """
+    Runs face detection with the given backend (see face_detectors), optionally
+    on a frame resized by detection_scale, and returns face locations in the
+    original frame's coordinates.
+    """
+    detector = get_detector(detector)
+    if detection_scale == 1.0:
+        return detector.detect(frame)
+
+    small = cv2.resize(frame, None, fx=detection_scale, fy=detection_scale, interpolation=cv2.INTER_AREA)
+    small_locations = detector.detect(small)
+    height, width = frame.shape[:2]
+    return [(max(int(top / detection_scale), 0), min(int(right / detection_scale), width),
+             min(int(bottom / detection_scale), height), max(int(left / detection_scale), 0))
+            for top, right, bottom, left in small_locations]
+
+def encode_face_crop(frame, face_location, margin=0.5):
+    """
+    Encodes one face from a full-resolution crop around its box instead of
+    converting and passing the whole frame.
+    """
+    top, right, bottom, left = face_location
+    height, width = frame.shape[:2]
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    y0, y1 = max(top - pad_y, 0), min(bottom + pad_y, height)
+    x0, x1 = max(left - pad_x, 0), min(right + pad_x, width)
+    rgb_crop = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+    encodings = face_recognition.face_encodings(rgb_crop, [(top - y0, right - x0, bottom - y0, left - x0)])
+    return encodings[0] if encodings else None
+
+def detect_and_encode(frame, detection_scale=1.0, detector='hog'):
+    """
+    Returns (status, face_location, encoding). status is None when exactly one
+    face was found and encoded, otherwise the error status used by recognize().
+    With detection_scale < 1 or another detector than HOG, faces are found on
+    the (downscaled) frame and encoded from a full-resolution crop.
+    """
+    if detection_scale != 1.0 or detector != 'hog':
+        face_locations = detect_faces(frame, detection_scale, detector)
+        if len(face_locations) == 0:
+            return 'no_persons_found', None, None
+        if len(face_locations) > 1:
+            return 'multiple_faces_detected', None, None
+        encoding = encode_face_crop(frame, face_locations[0])
+        if encoding is None:
+            return 'no_persons_found', None, None
+        return None, face_locations[0], encoding
+
     rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     face_locations = face_recognition.face_locations(rgb_frame)
     if len(face_locations) == 0:
-        return 'no_persons_found', None
+        return 'no_persons_found', None, None
     if len(face_locations) > 1:
-        return 'multiple_faces_detected', None
+        return 'multiple_faces_detected', None, None
 
     face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
     if not face_encodings:
-        return 'no_persons_found', None
+        return 'no_persons_found', None, None
 
-    encoding = face_encodings[0]
+    return None, face_locations[0], face_encodings[0]
 
+def recognize(frame, db_dir, known_encodings=None, known_names=None, use_multi_encodings=False, gallery=None,
+              avg_gallery=None, detection_scale=1.0, detector='hog'):
+    with timed('recognize'):
+        with timed('detect_and_encode'):
+            status, _, encoding = detect_and_encode(frame, detection_scale, detector)
+        if status is not None:
+            incr(status)
+            return status, None
+
+        with timed('identify'):
+            result = identify(encoding, db_dir, known_encodings, known_names, use_multi_encodings, gallery,
+                              avg_gallery)
+        incr('frames_unknown' if result[0] == 'unknown_person' else 'frames_recognized')
+        return result
+
+def identify(encoding, db_dir, known_encodings=None, known_names=None, use_multi_encodings=False, gallery=None,
+             avg_gallery=None):
     if use_multi_encodings:
-        all_encodings = []
-        all_names = []
-        for user in os.listdir(db_dir):
-            user_path = os.path.join(db_dir, user)
-            if not os.path.isdir(user_path):
-                continue
-            for file in os.listdir(user_path):
-                if file.endswith('.pkl') and file != 'avg_encoding.pkl':
-                    file_path = os.path.join(user_path, file)
-                    try:
-                        with open(file_path, 'rb') as f:
-                            enc = pickle.load(f)
-                            all_encodings.append(enc)
-                            all_names.append(user)
-                    except:
-                        continue
-
-        if not all_encodings:
-            return 'unknown_person', None
+        if gallery is None:
+            gallery = FaceGallery.from_db(db_dir)
 
-        matches = face_recognition.compare_faces(all_encodings, encoding, tolerance=0.53)
-        if np.any(matches):
-            matched_idx = np.argmax(matches)
-            matched_user = all_names[matched_idx]
-            users_file = os.path.join(db_dir, 'users.json')
-            with open(users_file, 'r') as f:
-                users_data = json.load(f)
-            return matched_user, users_data.get(matched_user, "N/A")
+        matched_user = gallery.match(encoding, tolerance=0.53)
+        if matched_user is not None:
+            return matched_user, get_user_directory(os.path.join(db_dir, 'users.json')).emp_id_for(matched_user)
         else:
             return 'unknown_person', None
 
     else:
-        matches = face_recognition.compare_faces(known_encodings, encoding, tolerance=0.43)
-        if np.any(matches):
-            matched_idx = matches.index(True)
-            matched_user = known_names[matched_idx]
-            users_file = os.path.join(db_dir, 'users.json')
-            with open(users_file, 'r') as f:
-                users_data = json.load(f)
-            return matched_user, users_data.get(matched_user, "N/A")
+        if avg_gallery is not None:
+            matched_user = avg_gallery.match(encoding, tolerance=0.43)
+        elif len(known_encodings):
+            # Closest match within tolerance rather than the first one
+            distances = face_recognition.face_distance(known_encodings, encoding)
+            best = int(np.argmin(distances))
+            matched_user = known_names[best] if distances[best] <= 0.43 else None
+        else:
+            matched_user = None
+        if matched_user is not None:
+            return matched_user, get_user_directory(os.path.join(db_dir, 'users.json')).emp_id_for(matched_user)
         else:
             return 'unknown_person', None
 
-def load_known_faces(db_path):
-    known_avg_encodings = []
-    known_names = []
-    multi_encodings_dict = {}
+def verify_encoding(encoding, user, db_dir, gallery, tolerance=0.53):
+    """
+    Returns (user, emp_id) if the encoding belongs to user, else
+    ('unknown_person', None), comparing against that user's encodings only.
+    """
+    if gallery.verify(encoding, user, tolerance):
+        incr('verify_accepted')
+        return user, get_user_directory(os.path.join(db_dir, 'users.json')).emp_id_for(user)
+    incr('verify_rejected')
+    return 'unknown_person', None
+
+def verify(frame, user, db_dir, gallery, tolerance=0.53, detection_scale=1.0, detector='hog',
+           identify_on_mismatch=False, **identify_kwargs):
+    """
+    Answers "is this user in front of the camera?" with a 1:1 check and returns
+    the same (status, emp_id) pair as recognize(). With identify_on_mismatch a
+    rejected face falls back to a full 1:N identify() (given identify_kwargs)
+    so the caller can tell another registered user from an unknown one.
+    """
+    with timed('verify'):
+        with timed('detect_and_encode'):
+            status, _, encoding = detect_and_encode(frame, detection_scale, detector)
+        if status is not None:
+            incr(status)
+            return status, None
 
-    for user_folder in os.listdir(db_path):
-        user_path = os.path.join(db_path, user_folder)
-        if not os.path.isdir(user_path):
-            continue
+        result = verify_encoding(encoding, user, db_dir, gallery, tolerance)
+        if result[0] == 'unknown_person' and identify_on_mismatch:
+            with timed('identify'):
+                result = identify(encoding, db_dir, **identify_kwargs)
+        return result
+
+def recognize_all(frame, db_dir, gallery, detection_scale=1.0, tolerance=0.53, detector='hog'):
+    """
+    Detects and encodes every face in the frame in one pass and matches them
+    all against the gallery at once.
+    Returns a list of (name, emp_id, face_location); unknown faces get
+    ('unknown_person', None, face_location).
+    """
+    face_locations = detect_faces(frame, detection_scale, detector)
+    if not face_locations:
+        return []
+
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+    if not face_encodings:
+        return []
+
+    users = get_user_directory(os.path.join(db_dir, 'users.json'))
+    results = []
+    for name, face_location in zip(gallery.match_batch(face_encodings, tolerance), face_locations):
+        if name is None:
+            results.append(('unknown_person', None, face_location))
+        else:
+            results.append((name, users.emp_id_for(name), face_location))
+    incr('faces_recognized', sum(1 for name, _, _ in results if name != 'unknown_person'))
+    incr('faces_unknown', sum(1 for name, _, _ in results if name == 'unknown_person'))
+    return results
 
-        encoding_path = os.path.join(user_path, 'avg_encoding.pkl')
-        if os.path.exists(encoding_path):
-            with open(encoding_path, 'rb') as f:
-                avg_encoding = pickle.load(f)
-                known_avg_encodings.append(avg_encoding)
-                known_names.append(user_folder)
-
-        # Load multi-encodings
-        multi_path = os.path.join(user_path, 'multi_encodings.pkl')
-        if os.path.exists(multi_path):
-            with open(multi_path, 'rb') as f:
-                multi_encodings = pickle.load(f)
-                multi_encodings_dict[user_folder] = multi_encodings
-
-    return known_avg_encodings, known_names, multi_encodings_dict
+def load_known_faces(db_path, store=None):
+    """(average encoding matrix, names) straight from the store's memmap; per-user encodings are in FaceGallery."""
+    if store is None:
+        store = open_store(db_path)
+    return store.avg, list(store.names)
 
 def match_face_multi(current_encoding, multi_encodings_dict, tolerance=0.42):
     """